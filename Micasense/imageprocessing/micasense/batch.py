@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Parallel batch conversion of raw images to reflectance
+
+    Converts every raw image below an input directory to a reflectance image
+    at the same relative path below an output directory, using a radiance to
+    reflectance conversion factor per band (as produced from calibration
+    panel images).  The conversion runs as a micasense.pipeline: a pool of
+    worker processes, each with its own exiftool session and correction map
+    caches, reads the tags and pixels of each raw image in one pass and
+    calibrates and encodes its reflectance image, and writer threads write
+    them to disk, so that disk and cpus are busy at the same time.  With
+    --threads, reader threads read the raw images and compute threads sharing
+    one set of caches encode them instead, which saves starting processes but
+    only scales while the threads are in code releasing the GIL.  The metadata
+    of each raw image is copied onto its reflectance image with exiftool in the
+    background as they are written.
+
+    Each converted image is recorded in a manifest (by default manifest.sqlite
+    in the output directory), so a re-run only converts the raw images which
+    are new or changed, or whose calibration factor or run configuration
+    changed, and resumes an interrupted run where it stopped.
+
+    python -m micasense.batch <input> <output> --calibration calibration.json
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import fnmatch
+import argparse
+import cv2
+import numpy as np
+import micasense
+import micasense.manifest as manifest
+import micasense.metadata as metadata
+import micasense.metadatawriter as metadatawriter
+import micasense.pipeline as pipeline
+import micasense.radiometry as radiometry
+import micasense.tiffreader as tiffreader
+import micasense.tiffwriter as tiffwriter
+import micasense.utils as msutils
+
+# default name of the manifest in the output directory
+MANIFEST_NAME = 'manifest.sqlite'
+
+def load_calibration(path):
+    ''' Read a {band name: radiance to reflectance factor} JSON file '''
+    with open(path) as f:
+        calibration = json.load(f)
+    return {band: float(factor) for band, factor in calibration.items()}
+
+def save_calibration(calibration, path):
+    ''' Write a {band name: radiance to reflectance factor} JSON file '''
+    with open(path, 'w') as f:
+        json.dump({band: float(factor) for band, factor in calibration.items()}, f, indent=2, sort_keys=True)
+
+def find_images(input_dir, output_dir):
+    ''' (raw image, reflectance image) paths of every tif below input_dir, in a stable order '''
+    jobs = []
+    for root, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for filename in sorted(fnmatch.filter(filenames, '*.tif')):
+            source = os.path.join(root, filename)
+            jobs.append((source, os.path.join(output_dir, os.path.relpath(source, input_dir))))
+    return jobs
+
+def reflectance_tiff(path, meta, raw, calibration, dtype=None, write_options=None):
+    ''' The TIFF bytes of the reflectance image of the raw pixels raw of the image at path,
+    with the Metadata meta, encoded with the tiffwriter.encode_tiff() options write_options '''
+    band = meta.band_name()
+    if band not in calibration:
+        raise ValueError("No radiance to reflectance factor for band {} of {}".format(band, path))
+    reflectance = msutils.raw_image_to_reflectance(meta, raw, calibration[band], dtype)
+    return tiffwriter.encode_reflectance(reflectance, dtype, **(write_options or {}))
+
+def write_output(output, data):
+    ''' Write the bytes data to output, creating its directory if needed '''
+    output_dir = os.path.dirname(output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output, 'wb') as f:
+        f.write(data)
+
+def convert_image(img, output, calibration, dtype=None, write_options=None):
+    ''' Write the reflectance image of the Image img to output, with the
+    tiffwriter.encode_tiff() options write_options '''
+    write_output(output, reflectance_tiff(img.path, img.meta, img.raw(), calibration, dtype, write_options))
+
+def read_raw(job):
+    ''' Reader stage: (raw image, exif, raw pixels) of a (raw image, reflectance image) job '''
+    source, output = job
+    exif, raw = tiffreader.read_image(source)
+    # copied, so that the file is read here rather than when the pixels are first used
+    return source, exif, np.array(raw)
+
+def encode_image(raw_image, calibration, dtype=None, write_options=None):
+    ''' Compute stage: (band name, reflectance TIFF bytes) of a (raw image, exif, raw
+    pixels) from read_raw(); the bytes are None if calibration has no factor for the band '''
+    source, exif, raw = raw_image
+    meta = metadata.Metadata(source, exif=exif, backend='native')
+    band = meta.band_name()
+    if band not in calibration:
+        return band, None
+    return band, reflectance_tiff(source, meta, raw, calibration, dtype, write_options)
+
+def encode_task(task):
+    ''' Compute stage on threads: encode_image() of a (raw image from read_raw(), calibration,
+    dtype, write_options) task from Conversion.read() '''
+    return encode_image(*task)
+
+def read_encode_task(task):
+    ''' Compute stage on worker processes: encode_image() of a (job, calibration, dtype,
+    write_options) task from Conversion.read(), reading the raw image of the job here
+    rather than sending its pixels to the worker through a pipe '''
+    job, calibration, dtype, write_options = task
+    return encode_image(read_raw(job), calibration, dtype, write_options)
+
+def initialize_worker(exiftoolPath=None):
+    ''' Initializer of the worker processes of a conversion '''
+    # the pool provides the parallelism, so keep OpenCV from starting threads of its own
+    cv2.setNumThreads(1)
+    metadata.hold_exiftool_session(exiftoolPath)
+
+def run_config(dtype, write_options, transfer_metadata):
+    ''' The configuration of a run recorded in the manifest; a change to any of it
+    invalidates the reflectance images written before '''
+    return {'version': micasense.__version__, 'dtype': dtype, 'write_options': write_options,
+            'metadata': bool(transfer_metadata)}
+
+class Conversion(object):
+    ''' The conversion of the raw images below input_dir to reflectance images below
+    output_dir, with the options of process_directory().  jobs are the (raw image,
+    reflectance image) paths left to convert after checking the manifest, and read()
+    and write() the reader and writer stages of each, so that the conversions of several
+    directories can share one pipeline (see micasense.scheduler).  Raw images of a band
+    without a factor in calibration are not converted, but added to skipped as (raw image,
+    band name).  close() once done. '''
+    def __init__(self, input_dir, output_dir, calibration, exiftoolPath=None, dtype=None,
+                 transfer_metadata=True, write_options=None, manifest_path=None, force=False):
+        self.calibration = calibration
+        self.dtype = radiometry.get_dtype(dtype)
+        # the compute workers already use every cpu, so each image is encoded on a single thread
+        self.write_options = dict({'threads': 1}, **(write_options or {}))
+        self.config = run_config(self.dtype, self.write_options, transfer_metadata)
+        self.jobs = find_images(input_dir, output_dir)
+        self.manifest = None
+        if manifest_path is not False and self.jobs:
+            os.makedirs(output_dir, exist_ok=True)
+            self.manifest = manifest.Manifest(manifest_path or os.path.join(output_dir, MANIFEST_NAME))
+            if not force:
+                up_to_date = set(self.manifest.current(self.jobs, calibration, self.config))
+                self.jobs = [job for job in self.jobs if job not in up_to_date]
+        self.skipped = []
+        self.__bands = {}
+        self.writer = None
+        if transfer_metadata and self.jobs:
+            self.writer = metadatawriter.MetadataWriter(
+                exiftoolPath, on_transferred=self.__on_transferred if self.manifest is not None else None)
+
+    def __on_transferred(self, pairs):
+        # recorded only once exiftool has rewritten the outputs
+        self.manifest.record([(source, output, self.__bands[source]) for source, output in pairs],
+                             self.calibration, self.config)
+
+    def read(self, job, processes):
+        ''' Reader stage: the task of a job for the compute stage, read_encode_task() if
+        processes and encode_task() otherwise '''
+        return (job if processes else read_raw(job)), self.calibration, self.dtype, self.write_options
+
+    def write(self, job, result):
+        ''' Writer stage: write the reflectance image of a job, queue the transfer of its
+        metadata and record it in the manifest.  Returns the job, or None if it was skipped. '''
+        source, output = job
+        band, data = result
+        if data is None:
+            self.skipped.append((source, band))
+            return None
+        write_output(output, data)
+        if self.writer is not None:
+            self.__bands[source] = band
+            self.writer.submit(source, output)
+        elif self.manifest is not None:
+            self.manifest.record([(source, output, band)], self.calibration, self.config)
+        return source, output
+
+    def close(self):
+        ''' Wait for the metadata transfers and close the manifest; raises any transfer error '''
+        try:
+            if self.writer is not None:
+                self.writer.close()
+        finally:
+            if self.manifest is not None:
+                self.manifest.close()
+
+def process_directory(input_dir, output_dir, calibration, workers=None, exiftoolPath=None,
+                      dtype=None, transfer_metadata=True, progress_callback=None, write_options=None,
+                      manifest_path=None, force=False, readers=pipeline.READERS, writers=pipeline.WRITERS,
+                      processes=True):
+    ''' Convert every raw image below input_dir to a reflectance image below output_dir
+    on workers worker processes (one per cpu if None) reading and converting the raw
+    images, with writers threads writing the reflectance images, copying the metadata
+    of each raw image onto its reflectance image if transfer_metadata.  If not processes,
+    workers compute threads convert the raw images read by readers threads instead.
+    The images are encoded with the tiffwriter.encode_tiff() options write_options (by
+    default DEFLATE compressed with a predictor, each encoded on one thread).
+
+    Each reflectance image is recorded, once complete, in the manifest at manifest_path
+    (MANIFEST_NAME in output_dir if None, no manifest if False), and raw images whose
+    reflectance image is recorded as up to date are skipped unless force.
+
+    Returns (converted, skipped): the (raw image, reflectance image) paths converted, and
+    the (raw image, band name) of the raw images of a band without a factor in calibration,
+    which are left out rather than failing the run. '''
+    conversion = Conversion(input_dir, output_dir, calibration, exiftoolPath, dtype, transfer_metadata,
+                            write_options, manifest_path, force)
+    try:
+        stages = pipeline.Pipeline(lambda job: conversion.read(job, processes),
+                                   read_encode_task if processes else encode_task, conversion.write,
+                                   readers=readers, workers=workers, writers=writers, processes=processes,
+                                   initializer=initialize_worker, initargs=(exiftoolPath,))
+        converted = [job for job in stages.run(conversion.jobs, progress_callback) if job is not None]
+        return converted, conversion.skipped
+    finally:
+        conversion.close()
+
+def add_arguments(parser):
+    ''' Add the options of the conversion to reflectance images to an ArgumentParser '''
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: one per cpu)')
+    parser.add_argument('--threads', action='store_true',
+                        help='convert on compute threads of this process instead of worker processes')
+    parser.add_argument('--dtype', choices=radiometry.PIXEL_DTYPES, default=None,
+                        help='pixel type of the reflectance images (default: float32)')
+    parser.add_argument('--compression', choices=sorted(tiffwriter.COMPRESSIONS), default='deflate',
+                        help='compression of the reflectance images (default: deflate)')
+    parser.add_argument('--level', type=int, default=None, help='compression level')
+    parser.add_argument('--no-predictor', action='store_true',
+                        help='compress the reflectance images without a predictor')
+    parser.add_argument('--tile', type=int, default=None,
+                        help='write the reflectance images in TILE x TILE tiles (a multiple of 16) '
+                             'instead of strips')
+    parser.add_argument('--exiftool', default=None, help='path of the exiftool executable')
+    parser.add_argument('--no-metadata', action='store_true',
+                        help='do not copy the metadata of the raw images onto the reflectance images')
+    parser.add_argument('--force', action='store_true',
+                        help='convert every raw image, even those recorded as up to date')
+
+def parsed_write_options(parser, args):
+    ''' The tiffwriter.encode_tiff() options of the arguments parsed with add_arguments()
+    by parser, exiting with a parser error if the compression can't be written here '''
+    if not tiffwriter.available(args.compression, args.tile):
+        parser.error('{}{} compression requires the {} package'.format(
+            'tiled ' if args.tile else '', args.compression,
+            'imagecodecs' if args.compression == 'lzw' else 'zstandard or imagecodecs'))
+    return {'compression': args.compression, 'level': args.level, 'predictor': not args.no_predictor,
+            'tile': args.tile}
+
+def print_skipped(skipped):
+    ''' Report the (raw image, band name) skipped for want of a calibration factor '''
+    if skipped:
+        print('Skipped {} images of bands without a radiance to reflectance factor: {}'.format(
+              len(skipped), ', '.join(sorted(set(str(band) for _, band in skipped)))))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m micasense.batch',
+                                     description='Convert raw MicaSense images to reflectance images.')
+    parser.add_argument('input', help='directory of raw images, searched recursively')
+    parser.add_argument('output', help='directory to write the reflectance images to')
+    parser.add_argument('-c', '--calibration', required=True,
+                        help='JSON file of the radiance to reflectance factor of each band name')
+    parser.add_argument('--manifest', default=None,
+                        help='manifest of the converted images (default: {} in the output directory)'
+                             .format(MANIFEST_NAME))
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    write_options = parsed_write_options(parser, args)
+
+    def progress(fraction):
+        sys.stdout.write('\r{:5.1f}%'.format(100 * fraction))
+        sys.stdout.flush()
+    done, skipped = process_directory(args.input, args.output, load_calibration(args.calibration),
+                                      workers=args.workers, exiftoolPath=args.exiftool, dtype=args.dtype,
+                                      transfer_metadata=not args.no_metadata, progress_callback=progress,
+                                      write_options=write_options, manifest_path=args.manifest,
+                                      force=args.force, processes=not args.threads)
+    print('\nConverted {} images to reflectance'.format(len(done)))
+    print_skipped(skipped)
+
+if __name__ == '__main__':
+    main()
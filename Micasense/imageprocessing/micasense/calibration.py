@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Calibration panel radiance to reflectance factors
+
+    Finds the calibration panel in every band of the pre- and post-flight
+    panel images, from the QR code of the panel, and computes the radiance to
+    reflectance conversion factor of each band as the known reflectance of
+    the panel divided by its mean radiance.  The images are processed in
+    parallel, and the factors of each band are averaged and written as a
+    {band name: factor} JSON file for micasense.batch.
+
+    python -m micasense.calibration <panel images or folders> --panel panel.json --output calibration.json
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+import fnmatch
+import argparse
+import multiprocessing
+import numpy as np
+import micasense.image as image
+import micasense.capture as capture
+import micasense.metadata as metadata
+import micasense.batch as batch
+
+def panel_images(paths):
+    ''' The tif files given directly or found below the directories in paths '''
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirnames, names in os.walk(path):
+                dirnames.sort()
+                filenames += [os.path.join(root, name) for name in sorted(fnmatch.filter(names, '*.tif'))]
+        else:
+            filenames.append(path)
+    return filenames
+
+def load_panel_reflectance(path):
+    ''' Read a {band name: reflectance of the calibration panel} JSON file '''
+    with open(path) as f:
+        return {band: float(reflectance) for band, reflectance in json.load(f).items()}
+
+def panel_factor(filename, panel_reflectance, panel_corners=None):
+    ''' (band name, radiance to reflectance factor) of a calibration panel image, given the
+    {band name: reflectance} of the panel.  panel_corners overrides finding the panel. '''
+    band, factor = _detect_panel(filename, panel_reflectance, panel_corners)
+    if factor is None:
+        raise IOError("Panel not detected in {}".format(filename))
+    return band, factor
+
+def _detect_panel(filename, panel_reflectance, panel_corners=None):
+    # as panel_factor(), with a factor of None if the panel is not detected
+    img = image.Image(filename)
+    if img.band_name not in panel_reflectance:
+        raise ValueError("No panel reflectance for band {} of {}".format(img.band_name, filename))
+    cap = capture.Capture([img], panelCorners=[panel_corners])
+    if cap.detect_panels() != 1:
+        return img.band_name, None
+    radiance = cap.panel_radiance()[0]
+    return img.band_name, panel_reflectance[img.band_name] / radiance
+
+def _panel_factor(args):
+    return _detect_panel(*args)
+
+def panel_factors(tasks, workers=None):
+    ''' The (band name, radiance to reflectance factor) of each (filename, panel reflectance,
+    panel corners) in tasks, as from panel_factor() but with a factor of None where the panel
+    is not detected, computed on a pool of workers (one per task, up to one per cpu, if None) '''
+    workers = workers or min(len(tasks), multiprocessing.cpu_count())
+    if workers <= 1:
+        return [_panel_factor(task) for task in tasks]
+    pool = multiprocessing.Pool(processes=workers, initializer=metadata.hold_exiftool_session)
+    try:
+        return pool.map(_panel_factor, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def average_factors(filenames, results):
+    ''' {band name: mean factor} of the (band name, factor) panel_factors() results of the
+    panel images filenames.  Images in which the panel was not detected are skipped with a
+    message; raises IOError if it was not detected in any image of a band. '''
+    factors = {}
+    for filename, (band, factor) in zip(filenames, results):
+        values = factors.setdefault(band, [])
+        if factor is None:
+            print("Panel not detected in {}, skipped".format(filename))
+        else:
+            values.append(factor)
+    missing = sorted(band for band, values in factors.items() if not values)
+    if missing:
+        raise IOError("Panel not detected in any image of band {}".format(', '.join(missing)))
+    return {band: float(np.mean(values)) for band, values in factors.items()}
+
+def calibrate_panels(filenames, panel_reflectance, panel_corners=None, workers=None):
+    ''' {band name: radiance to reflectance factor} of the calibration panel images filenames,
+    averaged over the images of each band (e.g. before and after a flight).  The images are
+    processed on a pool of workers (one per image, up to one per cpu, if None).
+    panel_corners is an optional {filename: corners} of panels located by hand.  Images in
+    which the panel is not detected are skipped, as in average_factors(). '''
+    if not filenames:
+        raise IOError("No calibration panel images")
+    panel_corners = panel_corners or {}
+    tasks = [(filename, panel_reflectance, panel_corners.get(filename)) for filename in filenames]
+    return average_factors(filenames, panel_factors(tasks, workers))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m micasense.calibration',
+                                     description='Compute the radiance to reflectance factor of each band '
+                                                 'from calibration panel images.')
+    parser.add_argument('images', nargs='+', help='calibration panel images, or directories of them')
+    parser.add_argument('-p', '--panel', required=True,
+                        help='JSON file of the reflectance of the calibration panel in each band name')
+    parser.add_argument('-o', '--output', required=True,
+                        help='JSON file to write the radiance to reflectance factor of each band to')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: one per image, up to one per cpu)')
+    args = parser.parse_args(argv)
+
+    calibration = calibrate_panels(panel_images(args.images), load_panel_reflectance(args.panel),
+                                   workers=args.workers)
+    batch.save_calibration(calibration, args.output)
+    for band, factor in sorted(calibration.items()):
+        print('{}: {:1.3f}'.format(band, factor))
+
+if __name__ == '__main__':
+    main()
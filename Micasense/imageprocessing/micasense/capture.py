@@ -87,7 +87,7 @@ class Capture(object):
         
     @classmethod
     def from_filelist(cls, file_list):
-        images = [image.Image(fle) for fle in file_list]
+        images = image.Image.from_files(file_list)
         return cls(images)
 
     def __plot(self, imgs, num_cols=3, plot_type=None, colorbar=True, figsize=(14, 14)):
@@ -125,10 +125,10 @@ class Capture(object):
 
     def clear_image_data(self):
         '''Clears (dereferences to allow garbage collection) all internal image
-           data stored in this class.  Call this after processing-heavy image
-           calls to manage program memory footprint.  When processing many images,
-           such as iterating over the captures in an ImageSet, it may be necessary
-           to call this after capture is processed''' 
+           data stored in this class.  Image data is also released automatically,
+           least recently used first, once all images together hold more than the
+           budget of the shared micasense.imagecache; call this to release the
+           data of a processed capture immediately''' 
         for img in self.images:
             img.clear_image_data()
 
@@ -229,13 +229,14 @@ class Capture(object):
             figsize=(12, 6),
             plot_type='Undistored Reflectance')
 
-    def compute_reflectance(self, irradiance_list):
+    def compute_reflectance(self, irradiance_list, dtype=None):
         '''Compute image reflectance from irradiance list, but don't return'''
-        [img.reflectance(irradiance_list[i]) for i,img in enumerate(self.images)]
+        [img.reflectance(irradiance_list[i], dtype=dtype) for i,img in enumerate(self.images)]
     
-    def reflectance(self, irradiance_list):
-        '''Comptute and return list of reflectance images for given irradiance'''
-        return [img.reflectance(irradiance_list[i]) for i,img in enumerate(self.images)]
+    def reflectance(self, irradiance_list, dtype=None):
+        '''Comptute and return list of reflectance images for given irradiance.
+        dtype overrides the pixel dtype policy of micasense.radiometry'''
+        return [img.reflectance(irradiance_list[i], dtype=dtype) for i,img in enumerate(self.images)]
 
     def panel_raw(self):
         if self.panels is None:
@@ -284,14 +285,13 @@ class Capture(object):
         from micasense.panel import Panel
         if self.panels is not None and self.detected_panel_count == len(self.images):
             return self.detected_panel_count
-        self.panels = [Panel(img,panelCorners=pc) for img,pc in zip(self.images,self.panelCorners)]
+        panelCorners = self.panelCorners if self.panelCorners is not None else [None]*len(self.images)
+        self.panels = [Panel(img,panelCorners=pc) for img,pc in zip(self.images,panelCorners)]
         self.detected_panel_count = 0
-        for p in self.panels:
-            if p.panel_detected():
+        for p,pc in zip(self.panels,panelCorners):
+            # panels with corners defined by hand count as detected
+            if pc is not None or p.panel_detected():
                 self.detected_panel_count += 1
-        # is panelCorners are defined by hand
-        if self.panelCorners is not None:
-           self.detected_panel_count = len(self.panelCorners) 
         return self.detected_panel_count               
 
     def plot_panels(self):
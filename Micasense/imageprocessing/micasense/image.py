@@ -34,45 +34,95 @@ import numpy as np
 import matplotlib.pyplot as plt
 import micasense.plotutils as plotutils
 import micasense.metadata as metadata
+import micasense.radiometry as radiometry
+import micasense.imagecache as imagecache
+import micasense.tiffreader as tiffreader
+import micasense.imageutils as imageutils
+
+class cached_metadata(object):
+    ''' An Image attribute which is decoded from the image metadata on first access
+    and then kept in the Image slot of the same name, prefixed with an underscore '''
+    def __init__(self, name, decode):
+        self.slot = '_' + name
+        self.decode = decode
+
+    def __get__(self, img, owner):
+        if img is None:
+            return self
+        try:
+            return getattr(img, self.slot)
+        except AttributeError:
+            value = self.decode(img.meta)
+            setattr(img, self.slot, value)
+            return value
 
 class Image(object):
     """
     An Image is a single file taken by a RedEdge camera representing one
     band of multispectral information
     """
-    def __init__(self, image_path):
+    __slots__ = ('path', 'meta', '__weakref__',
+                 '__raw_image', '__intensity_image', '__radiance_image', '__reflectance_image',
+                 '__reflectance_irradiance', '__undistorted_source', '__undistorted_image',
+                 '__undistorted_raw', '__undistorted_intensity', '__undistorted_radiance',
+                 '__undistorted_reflectance',
+                 '_utc_time', '_latitude', '_longitude', '_altitude', '_dls_present',
+                 '_dls_yaw', '_dls_pitch', '_dls_roll', '_dls_irradiance',
+                 '_capture_id', '_flight_id', '_camera_serial', '_band_name', '_band_index',
+                 '_black_level', '_radiometric_cal', '_exposure_time', '_gain', '_bits_per_pixel',
+                 '_vignette_center', '_vignette_polynomial', '_distortion_parameters',
+                 '_principal_point', '_focal_plane_resolution_px_per_mm', '_focal_length',
+                 '_center_wavelength', '_bandwidth')
+
+    # metadata derived attributes are only decoded when they are first used
+    utc_time = cached_metadata('utc_time', metadata.Metadata.utc_time)
+    latitude = cached_metadata('latitude', lambda meta: meta.position()[0])
+    longitude = cached_metadata('longitude', lambda meta: meta.position()[1])
+    altitude = cached_metadata('altitude', lambda meta: meta.position()[2])
+    dls_present = cached_metadata('dls_present', metadata.Metadata.dls_present)
+    dls_yaw = cached_metadata('dls_yaw', lambda meta: meta.dls_pose()[0])
+    dls_pitch = cached_metadata('dls_pitch', lambda meta: meta.dls_pose()[1])
+    dls_roll = cached_metadata('dls_roll', lambda meta: meta.dls_pose()[2])
+    dls_irradiance = cached_metadata('dls_irradiance', metadata.Metadata.dls_irradiance)
+    capture_id = cached_metadata('capture_id', metadata.Metadata.capture_id)
+    flight_id = cached_metadata('flight_id', metadata.Metadata.flight_id)
+    camera_serial = cached_metadata('camera_serial', metadata.Metadata.camera_serial)
+    band_name = cached_metadata('band_name', metadata.Metadata.band_name)
+    band_index = cached_metadata('band_index', metadata.Metadata.band_index)
+    black_level = cached_metadata('black_level', metadata.Metadata.black_level)
+    radiometric_cal = cached_metadata('radiometric_cal', metadata.Metadata.radiometric_cal)
+    exposure_time = cached_metadata('exposure_time', metadata.Metadata.exposure)
+    gain = cached_metadata('gain', metadata.Metadata.gain)
+    bits_per_pixel = cached_metadata('bits_per_pixel', metadata.Metadata.bits_per_pixel)
+    vignette_center = cached_metadata('vignette_center', metadata.Metadata.vignette_center)
+    vignette_polynomial = cached_metadata('vignette_polynomial', metadata.Metadata.vignette_polynomial)
+    distortion_parameters = cached_metadata('distortion_parameters', metadata.Metadata.distortion_parameters)
+    principal_point = cached_metadata('principal_point', metadata.Metadata.principal_point)
+    focal_plane_resolution_px_per_mm = cached_metadata('focal_plane_resolution_px_per_mm',
+                                                       metadata.Metadata.focal_plane_resolution_px_per_mm)
+    focal_length = cached_metadata('focal_length', metadata.Metadata.focal_length_mm)
+    center_wavelength = cached_metadata('center_wavelength', metadata.Metadata.center_wavelength)
+    bandwidth = cached_metadata('bandwidth', metadata.Metadata.bandwidth)
+
+    # pixel data held by an Image, registered with the shared micasense.imagecache,
+    # which clears the least recently used data when over its byte budget
+    IMAGE_DATA = ('raw_image', 'intensity_image', 'radiance_image', 'reflectance_image', 'undistorted_image',
+                  'undistorted_raw', 'undistorted_intensity', 'undistorted_radiance', 'undistorted_reflectance')
+    # the stages whose undistorted image is kept until the stage image changes
+    UNDISTORTED_STAGES = ('raw', 'intensity', 'radiance', 'reflectance')
+
+    def __init__(self, image_path, meta=None):
         if not os.path.isfile(image_path):
             raise IOError("Provided path is not a file: {}".format(image_path))
         self.path = image_path
-        self.meta = metadata.Metadata(self.path)
+        if meta is None:
+            meta = metadata.Metadata(self.path)
+        self.meta = meta
 
         if not self.meta.supports_radiometric_calibration():
             raise ValueError('Library requires images taken with camera firmware v2.1.0 or later. ' +
             'Upgrade your camera firmware to use this library.')
 
-        self.utc_time = self.meta.utc_time()
-        self.latitude, self.longitude, self.altitude = self.meta.position()
-        self.dls_present = self.meta.dls_present()
-        self.dls_yaw, self.dls_pitch, self.dls_roll = self.meta.dls_pose()
-        self.dls_irradiance = self.meta.dls_irradiance()
-        self.capture_id = self.meta.capture_id()
-        self.flight_id = self.meta.flight_id()
-        self.band_name = self.meta.band_name()
-        self.band_index = self.meta.band_index()
-        self.black_level = self.meta.black_level()
-        self.radiometric_cal = self.meta.radiometric_cal()
-        self.exposure_time = self.meta.exposure()
-        self.gain = self.meta.gain()
-        self.bits_per_pixel = self.meta.bits_per_pixel()
-        self.vignette_center = self.meta.vignette_center()
-        self.vignette_polynomial = self.meta.vignette_polynomial()
-        self.distortion_parameters = self.meta.distortion_parameters()
-        self.principal_point = self.meta.principal_point()
-        self.focal_plane_resolution_px_per_mm = self.meta.focal_plane_resolution_px_per_mm()
-        self.focal_length = self.meta.focal_length_mm()
-        self.center_wavelength = self.meta.center_wavelength()
-        self.bandwidth = self.meta.bandwidth()
-
         if self.bits_per_pixel != 16:
             NotImplemented("Unsupported pixel bit depth: {} bits".format(self.bits_per_pixel))
 
@@ -81,8 +131,29 @@ class Image(object):
         self.__radiance_image = None # calibrated to radiance
         self.__reflectance_image = None # calibrated to reflectance (0-1)
         self.__reflectance_irradiance = None
-        self.__undistorted_source = None # can be any of raw, intensity, radiance
-        self.__undistorted_image = None # current undistorted image, depdining on source
+        self.__undistorted_source = None # any image other than the stage images below
+        self.__undistorted_image = None # undistorted image of __undistorted_source
+        self.__undistorted_raw = None
+        self.__undistorted_intensity = None
+        self.__undistorted_radiance = None
+        self.__undistorted_reflectance = None
+
+    @classmethod
+    def from_files(cls, file_list, exiftoolPath=None, scan=False):
+        ''' Create Images for many files, extracting their metadata in bulk.  With
+        scan=True only the tags used by this library are extracted (see metadata.SCAN_TAGS) '''
+        metas = metadata.Metadata.from_files(file_list, exiftoolPath=exiftoolPath, scan=scan)
+        return [cls(fle, meta=meta) for fle, meta in zip(file_list, metas)]
+
+    @classmethod
+    def load(cls, image_path):
+        ''' Create an Image from a single read of image_path, which parses its tags and
+        maps (or decodes) its raw pixels together with micasense.tiffreader, whatever the
+        metadata backend.  raw() then returns the pixels without opening the file again. '''
+        exif, raw_image = tiffreader.read_image(image_path)
+        img = cls(image_path, meta=metadata.Metadata(image_path, exif=exif, backend='native'))
+        img.__hold('raw_image', raw_image)
+        return img
 
     def __lt__(self, other):
         return self.band_index < other.band_index
@@ -99,121 +170,151 @@ class Image(object):
                (self.capture_id != other.capture_id)
 
     def raw(self):
-        ''' Lazy load the raw image once neecessary '''
+        ''' Lazy load the raw image once neecessary.  Uncompressed images are memory
+        mapped copy-on-write, so pixels are only read from disk when they are used, and
+        the array can be changed in place without changing the file.  The map stays open
+        while the array is referenced; when the image data cache evicts the raw image,
+        the image drops its reference and the map is closed once no caller holds one. '''
         if self.__raw_image is None:
             try:
-                self.__raw_image = cv2.imread(self.path,-1)
+                raw_image = tiffreader.memmap_raw(self.path, mode='c')
+                if raw_image is None:
+                    raw_image = cv2.imread(self.path,-1)
+                self.__hold('raw_image', raw_image)
             except IOError:
                 print("Could not open image at path {}".format(self.path))
                 raise
+        else:
+            imagecache.get_cache().touch(self, 'raw_image')
         return self.__raw_image
-            
-    def clear_image_data(self):
-        ''' clear all computed images to reduce memory overhead '''
-        self.__raw_image = None
-        self.__intensity_image = None
-        self.__radiance_image = None
-        self.__reflectance_image = None
-        self.__reflectance_irradiance = None
-        self.__undistorted_source = None
-        self.__undistorted_image = None
+
+    def __hold(self, name, array):
+        ''' Keep array as the image data name, registered with the shared image data cache '''
+        if name.endswith('_image') and name[:-len('_image')] in self.UNDISTORTED_STAGES:
+            # a new stage image invalidates its undistorted image
+            self.clear_image_data(names=['undistorted_' + name[:-len('_image')]])
+        setattr(self, '_Image__' + name, array)
+        if array is not None:
+            imagecache.get_cache().add(self, name, array)
+        return array
+
+    def __used(self, name):
+        ''' Return the image data name, marking it as recently used '''
+        imagecache.get_cache().touch(self, name)
+        return getattr(self, '_Image__' + name)
+
+    def clear_image_data(self, names=None):
+        ''' clear all computed images to reduce memory overhead, or only the image
+        data listed in names (see Image.IMAGE_DATA), which is recomputed when next used '''
+        if names is None:
+            names = self.IMAGE_DATA
+            self.__reflectance_irradiance = None
+        cleared = set(names)
+        # undistorted images are dropped with their source
+        for name in names:
+            if name.endswith('_image') and name[:-len('_image')] in self.UNDISTORTED_STAGES:
+                cleared.add('undistorted_' + name[:-len('_image')])
+            if self.__undistorted_source is not None and getattr(self, '_Image__' + name) is self.__undistorted_source:
+                cleared.add('undistorted_image')
+        if 'undistorted_image' in cleared:
+            self.__undistorted_source = None
+        for name in cleared:
+            setattr(self, '_Image__' + name, None)
+        imagecache.get_cache().discard(self, cleared)
 
     def size(self):
         width, height = self.meta.image_size()
         return width, height
 
-    def reflectance(self, irradiance=None, force_recompute=False):
-        ''' Lazy-compute and return a reflectance image provided an irradiance reference '''
+    def reflectance(self, irradiance=None, force_recompute=False, dtype=None):
+        ''' Lazy-compute and return a reflectance image provided an irradiance reference.
+        dtype overrides the pixel dtype policy of micasense.radiometry '''
+        out_dtype = radiometry.output_dtype(dtype, reflectance=True)
         if self.__reflectance_image is not None \
             and force_recompute == False \
+            and self.__reflectance_image.dtype == out_dtype \
             and (self.__reflectance_irradiance == irradiance or irradiance == None):
-            return self.__reflectance_image
+            return self.__used('reflectance_image')
+        if irradiance is None:
+            irradiance = self.__reflectance_irradiance
         if irradiance is None:
             raise RuntimeError("Provide a band-specific spectral irradiance to compute reflectance")
         self.__reflectance_irradiance = irradiance
-        self.__reflectance_image = self.radiance() * math.pi / irradiance
-        return self.__reflectance_image
+        # fold pi / irradiance into the radiance scale, so no radiance image is computed or kept
+        scale = self.__scale_factors()[0] * math.pi / irradiance
+        return self.__hold('reflectance_image', self.__calibrated(scale, dtype, reflectance=True))
 
-    def intensity(self, force_recompute=False):
+    def intensity(self, force_recompute=False, dtype=None):
         ''' Lazy=computes and returns the intensity image after black level,
             vignette, and row correction applied. 
             Intensity is in units of DN*Seconds without a radiance correction '''
-        if self.__intensity_image is not None and force_recompute == False:
-            return self.__intensity_image
-
-        # get image dimensions
-        image_raw = np.copy(self.raw()).T
+        if self.__intensity_image is not None and force_recompute == False \
+            and self.__intensity_image.dtype == radiometry.output_dtype(dtype):
+            return self.__used('intensity_image')
 
-        #  get radiometric calibration factors
-        _, a2, a3 = self.radiometric_cal[0], self.radiometric_cal[1], self.radiometric_cal[2]
+        return self.__hold('intensity_image', self.__calibrated(self.__scale_factors()[1], dtype))
 
-        # apply image correction methods to raw image
-        V, x, y = self.vignette()
-        R = 1.0 / (1.0 + a2 * y / self.exposure_time - a3 * y)
-        L = V * R * (image_raw - self.black_level)
-        L[L < 0] = 0
-        max_raw_dn = float(2**self.bits_per_pixel)
-        intensity_image = L.astype(float)/(self.gain * self.exposure_time * max_raw_dn)
-
-        self.__intensity_image = intensity_image.T
-        return self.__intensity_image
-
-    def radiance(self, force_recompute=False):
+    def radiance(self, force_recompute=False, dtype=None):
         ''' Lazy=computes and returns the radiance image after all radiometric
         corrections have been applied '''
-        if self.__radiance_image is not None and force_recompute == False:
-            return self.__radiance_image
-
-        # get image dimensions
-        image_raw = np.copy(self.raw()).T
-
-        #  get radiometric calibration factors
-        a1, a2, a3 = self.radiometric_cal[0], self.radiometric_cal[1], self.radiometric_cal[2]
-
-        # apply image correction methods to raw image
-        V, x, y = self.vignette()
-        R = 1.0 / (1.0 + a2 * y / self.exposure_time - a3 * y)
-        L = V * R * (image_raw - self.black_level)
-        L[L < 0] = 0
-        max_raw_dn = float(2**self.bits_per_pixel)
-        radiance_image = L.astype(float)/(self.gain * self.exposure_time)*a1/max_raw_dn
-
-        self.__radiance_image = radiance_image.T
-        return self.__radiance_image
+        if self.__radiance_image is not None and force_recompute == False \
+            and self.__radiance_image.dtype == radiometry.output_dtype(dtype):
+            return self.__used('radiance_image')
+
+        return self.__hold('radiance_image', self.__calibrated(self.__scale_factors()[0], dtype))
+
+    def stream(self, stage='radiance', out=None, irradiance=None, block_rows=radiometry.BLOCK_ROWS, dtype=None):
+        ''' Compute the 'intensity', 'radiance' or 'reflectance' (given irradiance) image
+        block_rows rows at a time, straight into out (allocated in the pixel dtype if None).
+        Nothing is cached and no full size temporary is allocated, so peak memory is the
+        output plus a few row blocks. '''
+        radiance_scale, intensity_scale = self.__scale_factors()
+        if stage == 'intensity':
+            scale = intensity_scale
+        elif stage == 'radiance':
+            scale = radiance_scale
+        elif stage == 'reflectance':
+            if irradiance is None:
+                raise RuntimeError("Provide a band-specific spectral irradiance to compute reflectance")
+            scale = radiance_scale * math.pi / irradiance
+        else:
+            raise ValueError("Unknown stage {}, use intensity, radiance or reflectance".format(stage))
+        image_raw = self.raw()
+        # the row gradient is computed in the type of the output's calculations
+        compute = radiometry.compute_dtype(dtype if out is None else out.dtype)
+        R = radiometry.row_gradient(self.radiometric_cal, self.exposure_time, image_raw.shape[0], compute)
+        return radiometry.calibrate_streaming(image_raw, self.black_level, self.vignette_center,
+                                              self.vignette_polynomial, R, scale, out=out,
+                                              block_rows=block_rows, dtype=dtype,
+                                              reflectance=(stage == 'reflectance'))
+
+    def __scale_factors(self):
+        return radiometry.scale_factors(self.radiometric_cal, self.gain, self.exposure_time, self.bits_per_pixel)
+
+    def __calibrated(self, scale, dtype=None, reflectance=False):
+        ''' The raw image with black level, vignette and row gradient corrections
+        and the given scale applied, using the shared correction maps of micasense.radiometry,
+        converted to the pixel dtype (of a reflectance image if reflectance) '''
+        image_raw = self.raw()
+        height, width = image_raw.shape
+        V = radiometry.vignette_map(self.vignette_center, self.vignette_polynomial, width, height, dtype)
+        R = radiometry.row_gradient(self.radiometric_cal, self.exposure_time, height, dtype)
+        calibrated = radiometry.calibrate(image_raw, self.black_level, V, R, scale,
+                                          dtype=radiometry.compute_dtype(dtype))
+        return radiometry.convert(calibrated, dtype, reflectance)
 
     def vignette(self):
         ''' Get a numpy array which defines the value to multiply each pixel by to correct
         for optical vignetting effects.
         Note: this array is transposed from normal image orientation and comes as part
-        of a three-tuple, the other parts of which are also used by the radiance method.
+        of a three-tuple, the other parts of which are the (read-only) x and y pixel
+        coordinate grids in the same orientation.
         '''
-        # get vignette center
-        vignette_center_x, vignette_center_y = self.vignette_center
-
-        # get a copy of the vignette polynomial because we want to modify it here
-        v_poly_list = list(self.vignette_polynomial)
-
-        # reverse list and append 1., so that we can call with numpy polyval
-        v_poly_list.reverse()
-        v_poly_list.append(1.)
-        v_polynomial = np.array(v_poly_list)
-
-        # perform vignette correction
-        # get coordinate grid across image, seem swapped because of transposed vignette
-        x_dim, y_dim = self.raw().shape[1], self.raw().shape[0]
-        x, y = np.meshgrid(np.arange(x_dim), np.arange(y_dim))
-
-        #meshgrid returns transposed arrays
-        x = x.T
-        y = y.T
-
-        # compute matrix of distances from image center
-        r = np.hypot((x-vignette_center_x), (y-vignette_center_y))
-
-        # compute the vignette polynomial for each distance - we divide by the polynomial so that the
-        # corrected image is image_corrected = image_original * vignetteCorrection
-        vignette = 1./np.polyval(v_polynomial, r)
-        return vignette, x, y
+        width, height = self.size()
+        vignette = radiometry.vignette_map(self.vignette_center, self.vignette_polynomial, width, height)
+        x = np.broadcast_to(np.arange(width)[:, np.newaxis], (width, height))
+        y = np.broadcast_to(np.arange(height), (width, height))
+        return vignette.T, x, y
     
     def plottable_vignette(self):
         return self.vignette()[0].T
@@ -244,26 +345,33 @@ class Image(object):
 
     def undistorted(self, image):
         ''' return the undistorted image from input image '''
-        # If we have already undistorted the same source, just return that here
-        # otherwise, lazy compute the undstorted image
-        if self.__undistorted_source is not None and image.data == self.__undistorted_source.data:
-            return self.__undistorted_image
-        
-        self.__undistorted_source = image
-
-        new_cam_mat, _ = cv2.getOptimalNewCameraMatrix(self.cv2_camera_matrix(), 
-                                                       self.cv2_distortion_coeff(),
-                                                       self.size(), 
-                                                       1)
-        map1, map2 = cv2.initUndistortRectifyMap(self.cv2_camera_matrix(),
-                                                self.cv2_distortion_coeff(),
-                                                np.eye(3),
-                                                new_cam_mat,
-                                                self.size(),
-                                                cv2.CV_32F) # cv2.CV_32F for 32 bit floats
-        # compute the undistorted 16 bit image
-        self.__undistorted_image = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
-        return self.__undistorted_image
+        # The undistorted images of the raw, intensity, radiance and reflectance
+        # images are each kept until that image changes, and of one other image
+        # until another is given.  Sources are matched by identity.
+        name = 'undistorted_image'
+        for stage in self.UNDISTORTED_STAGES:
+            if image is getattr(self, '_Image__' + stage + '_image'):
+                name = 'undistorted_' + stage
+                break
+        if name != 'undistorted_image':
+            if getattr(self, '_Image__' + name) is not None:
+                return self.__used(name)
+        elif self.__undistorted_source is not None and image is self.__undistorted_source:
+            return self.__used(name)
+        else:
+            self.__undistorted_source = image
+
+        # the maps are shared by every image of this band of the camera
+        map1, map2 = imageutils.undistortion_maps(self.cv2_camera_matrix(),
+                                                  self.cv2_distortion_coeff(),
+                                                  self.size(),
+                                                  camera=(self.camera_serial, self.band_index))
+        # compute the undistorted 16 bit image; opencv cannot remap half floats
+        if image.dtype == np.float16:
+            undistorted = cv2.remap(image.astype(np.float32), map1, map2, cv2.INTER_LINEAR).astype(np.float16)
+        else:
+            undistorted = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+        return self.__hold(name, undistorted)
 
     def plot_raw(self, title=None, figsize=None):
         ''' Create a single plot of the raw image '''
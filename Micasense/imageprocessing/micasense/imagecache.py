@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Shared cache of image pixel data
+
+    Every micasense.image.Image registers the arrays it computes (raw,
+    intensity, radiance, reflectance and undistorted images) with one
+    process-wide least recently used cache.  When the arrays held by all
+    images exceed the byte budget, the least recently used arrays are
+    released with Image.clear_image_data() and recomputed on their next use,
+    so iterating over an ImageSet runs in bounded memory.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+# default budget of the image data cache, about 100 RedEdge bands of float32 data
+CACHE_BYTES = 512 * 1024 * 1024
+
+class ImageDataCache(object):
+    ''' Least recently used set of (image, name) arrays bounded by their total size.
+    Images are weakly referenced, so the cache never keeps an image alive. '''
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.__lock = threading.RLock()
+        self.__entries = OrderedDict()
+
+    def add(self, img, name, array):
+        ''' Register the array which img holds as name, evicting cold arrays if needed '''
+        key = (id(img), name)
+        evicted = []
+        with self.__lock:
+            self.__remove(key)
+            if self.max_bytes is not None and array.nbytes > 0:
+                ref = weakref.ref(img, lambda ref, key=key: self.__discard_key(key))
+                self.__entries[key] = (ref, array.nbytes)
+                self.nbytes += array.nbytes
+                evicted = self.__evict()
+        # release outside of the lock, clear_image_data calls back into discard
+        for img, name in evicted:
+            img.clear_image_data(names=[name])
+
+    def touch(self, img, name):
+        ''' Mark the array name of img as recently used '''
+        key = (id(img), name)
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+
+    def discard(self, img, names):
+        ''' Forget the arrays names of img, which it no longer holds '''
+        with self.__lock:
+            for name in names:
+                self.__remove((id(img), name))
+
+    def __discard_key(self, key):
+        with self.__lock:
+            self.__remove(key)
+
+    def __remove(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def __evict(self):
+        evicted = []
+        # the most recently added array is always kept
+        while self.nbytes > self.max_bytes and len(self.__entries) > 1:
+            (_, name), (ref, nbytes) = self.__entries.popitem(last=False)
+            self.nbytes -= nbytes
+            img = ref()
+            if img is not None:
+                evicted.append((img, name))
+        return evicted
+
+    def resize(self, max_bytes):
+        ''' Set the byte budget; None disables the cache and the eviction of image data '''
+        with self.__lock:
+            self.max_bytes = max_bytes
+            if max_bytes is None:
+                self.__entries.clear()
+                self.nbytes = 0
+                evicted = []
+            else:
+                evicted = self.__evict()
+        for img, name in evicted:
+            img.clear_image_data(names=[name])
+
+    def __len__(self):
+        return len(self.__entries)
+
+def budget_from_environment():
+    budget = os.environ.get('imagecache')
+    if budget is None:
+        return CACHE_BYTES
+    return None if budget.lower() == 'none' else int(budget)
+
+_cache = ImageDataCache(budget_from_environment())
+
+def get_cache():
+    return _cache
+
+def set_cache_size(max_bytes):
+    ''' Set the byte budget of the image data cache of this process (the imagecache
+    environment variable sets the initial budget); None keeps all image data until
+    it is cleared manually '''
+    _cache.resize(max_bytes)
@@ -30,35 +30,115 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 import os, glob, fnmatch
 import micasense.image as image
 import micasense.capture as capture
+import micasense.metadata as metadata
 import multiprocessing
+import functools
+import numpy as np
+import pytz
 
 def image_from_file(filename):
     return image.Image(filename)
 
+def images_from_files(filenames, scan=False):
+    return image.Image.from_files(filenames, scan=scan)
+
+def build_table(captures):
+    ''' Build a NumPy structured array with one row per image of the captures, in
+    capture order, holding the metadata used to group, sort and filter the images.
+    The capture_index column is the index of the image's capture in captures. '''
+    rows = [(i, cap, img) for i, cap in enumerate(captures) for img in cap.images]
+    def text(values):
+        return np.array(values, dtype='U{}'.format(max([1] + [len(v) for v in values])))
+    capture_ids = text([str(img.capture_id) for _, _, img in rows])
+    band_names = text([str(img.band_name) for _, _, img in rows])
+    paths = text([img.path for _, _, img in rows])
+    table = np.zeros(len(rows), dtype=[
+        ('capture_index', np.int32),
+        ('capture_id', capture_ids.dtype),
+        ('band_index', np.int16),
+        ('band_name', band_names.dtype),
+        ('center_wavelength', np.float64),
+        ('timestamp', 'datetime64[us]'),
+        ('latitude', np.float64),
+        ('longitude', np.float64),
+        ('altitude', np.float64),
+        ('dls_yaw', np.float64),
+        ('dls_pitch', np.float64),
+        ('dls_roll', np.float64),
+        ('dls_irradiance_raw', np.float64),
+        ('dls_irradiance', np.float64),
+        ('exposure_time', np.float64),
+        ('gain', np.float64),
+        ('path', paths.dtype),
+    ])
+    table['capture_id'] = capture_ids
+    table['band_name'] = band_names
+    table['path'] = paths
+    images = [img for _, _, img in rows]
+    table['capture_index'] = [capture_index for capture_index, _, _ in rows]
+    table['band_index'] = [img.band_index for img in images]
+    table['center_wavelength'] = [img.center_wavelength for img in images]
+    table['timestamp'] = np.array([img.utc_time.replace(tzinfo=None) for img in images], 'datetime64[us]')
+    table['latitude'] = [img.latitude for img in images]
+    table['longitude'] = [img.longitude for img in images]
+    table['altitude'] = [img.altitude for img in images]
+    table['dls_yaw'] = [img.dls_yaw for img in images]
+    table['dls_pitch'] = [img.dls_pitch for img in images]
+    table['dls_roll'] = [img.dls_roll for img in images]
+    table['dls_irradiance_raw'] = [img.dls_irradiance for img in images]
+    table['exposure_time'] = [img.exposure_time for img in images]
+    table['gain'] = [img.gain for img in images]
+
+    # corrected (ground) DLS irradiance, as in Capture.dls_irradiance
+    capture_index = table['capture_index']
+    fresnel_correction = np.array([cap.fresnel_correction for cap in captures])[capture_index]
+    sun_sensor_angle = np.array([cap.sun_sensor_angle for cap in captures])[capture_index]
+    solar_elevation = np.array([cap.solar_elevation for cap in captures])[capture_index]
+    percent_diffuse = 1.0/6.0
+    sensor_irradiance = table['dls_irradiance_raw'] / fresnel_correction
+    untilted_direct_irr = sensor_irradiance / (percent_diffuse + np.cos(sun_sensor_angle))
+    table['dls_irradiance'] = untilted_direct_irr * (percent_diffuse + np.cos(solar_elevation))
+    return table
+
 class ImageSet(object):
     """
     An ImageSet is a container for a group of captures that are processed together
+
+    The pixel data of its images is held in the shared micasense.imagecache, so
+    iterating over the captures of a large ImageSet runs in bounded memory
     """
     def __init__(self, captures):
         self.captures = captures
         captures.sort()
+        self.table = build_table(self.captures)
         
     @classmethod
-    def from_directory(cls, directory, progress_callback=None):
+    def from_directory(cls, directory, progress_callback=None, fast_scan=False):
         """
         Create and ImageSet recursively from the files in a directory
+
+        With fast_scan=True only the metadata tags used by this library are read
+        from each file, and the full tag set of an image is read if it is needed.
         """
         matches = []
         for root, dirnames, filenames in os.walk(directory):
             for filename in fnmatch.filter(filenames, '*.tif'):
                 matches.append(os.path.join(root, filename))
 
-        pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
+        # split the files into batches so that each worker reads the metadata of
+        # a whole batch in one exiftool round-trip
+        num_workers = multiprocessing.cpu_count()
+        batch_size = max(1, min(metadata.BATCH_SIZE, len(matches) // (4 * num_workers)))
+        batches = [matches[i:i+batch_size] for i in range(0, len(matches), batch_size)]
+
+        # each worker keeps one exiftool session open for all of the files it reads
+        pool = multiprocessing.Pool(processes=num_workers,
+                                    initializer=metadata.hold_exiftool_session)
         images = []
-        for i,img in enumerate(pool.imap_unordered(image_from_file, matches)):
-            images.append(img)
+        for imgs in pool.imap_unordered(functools.partial(images_from_files, scan=fast_scan), batches):
+            images += imgs
             if progress_callback is not None:
-                progress_callback(float(i)/float(len(matches)))
+                progress_callback(float(len(images))/float(len(matches)))
         pool.close() 
         pool.join()
         # create a dictionary to index the images so we can sort them
@@ -82,6 +162,40 @@ class ImageSet(object):
             progress_callback(1.0)
         return cls(captures)
     
+    def capture_rows(self):
+        ''' Indices into table of the first image of each capture, in capture order '''
+        _, first = np.unique(self.table['capture_index'], return_index=True)
+        return first
+
+    def irradiance_matrix(self, field='dls_irradiance'):
+        ''' A (captures x bands) array of a per-image table column, with the bands in the
+        order of the first capture and NaN where a capture is missing a band '''
+        band_indices = self.table['band_index'][self.table['capture_index'] == 0]
+        column = np.full(int(self.table['band_index'].max()) + 1, -1, dtype=np.int64)
+        column[band_indices] = np.arange(len(band_indices))
+        matrix = np.full((len(self.captures), len(band_indices)), np.nan)
+        cols = column[self.table['band_index']]
+        valid = cols >= 0
+        matrix[self.table['capture_index'][valid], cols[valid]] = self.table[field][valid]
+        return matrix
+
+    def timestamps(self):
+        ''' timezone-aware capture datetimes, in capture order '''
+        times = self.table['timestamp'][self.capture_rows()].astype(object)
+        return [pytz.utc.localize(t) for t in times]
+
+    def where(self, mask):
+        ''' Return a new ImageSet of the captures with at least one image selected by
+        mask, a boolean array over the rows of table, e.g.
+        imgset.where(imgset.table['altitude'] > 50) '''
+        capture_indices = np.unique(self.table['capture_index'][mask])
+        return ImageSet([self.captures[i] for i in capture_indices])
+
+    def as_dataframe(self):
+        ''' The image table as a pandas DataFrame '''
+        import pandas as pd
+        return pd.DataFrame(self.table)
+
     def as_nested_lists(self):
         columns = [
             'timestamp',
@@ -90,20 +204,15 @@ class ImageSet(object):
         ]
         irr = ["irr-{}".format(wve) for wve in self.captures[0].center_wavelengths()]
         columns += irr
-        data = [] 
-        for cap in self.captures:
-            dat = cap.utc_time()
-            loc = list(cap.location())
-            dls_pose = list(cap.dls_pose())
-            irr = cap.dls_irradiance()
-            row = [dat]+loc+dls_pose+irr
-            data.append(row)
+        first = self.table[self.capture_rows()]
+        values = np.column_stack([first[name] for name in
+                                  ('latitude', 'longitude', 'altitude', 'dls_yaw', 'dls_pitch', 'dls_roll')] +
+                                 [self.irradiance_matrix()])
+        data = [[dat] + row for dat, row in zip(self.timestamps(), values.tolist())]
         return data, columns
 
     def dls_irradiance(self):
         series = {}
-        for cap in self.captures:
-            dat = cap.utc_time().isoformat()
-            irr = cap.dls_irradiance()
-            series[dat] = irr
-
+        for dat, irr in zip(self.timestamps(), self.irradiance_matrix().tolist()):
+            series[dat.isoformat()] = irr
+        return series
@@ -23,9 +23,65 @@ IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import os
 import cv2
+import hashlib
 import numpy as np
 import multiprocessing
+import micasense.radiometry as radiometry
+
+# cv2 map type of undistortion maps: cv2.CV_16SC2 fixed point maps take 25% less
+# memory, but remap about twice as slowly as float maps with the opencv builds we use
+UNDISTORTION_MAP_TYPE = cv2.CV_32FC1
+_map_dir = None
+
+def set_undistortion_map_dir(path):
+    ''' Keep undistortion maps in the directory path across runs; None only keeps them
+    in memory.  The undistortionmaps environment variable sets the initial directory. '''
+    global _map_dir
+    _map_dir = path
+
+def undistortion_map_dir():
+    if _map_dir is not None:
+        return _map_dir
+    return os.environ.get('undistortionmaps')
+
+def undistortion_maps(camera_matrix, distortion_coeffs, size, camera=None, map_type=None):
+    ''' Get the pair of cv2.remap maps which undistort an image of size (width, height)
+    with the lens parameters of a band, of map_type (default UNDISTORTION_MAP_TYPE;
+    cv2.CV_16SC2 for fixed point maps).  Maps are kept in the shared correction cache
+    of micasense.radiometry, keyed by the optional camera label (e.g. serial number
+    and band index), the lens parameters, size and map type. '''
+    camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+    distortion_coeffs = np.asarray(distortion_coeffs, dtype=np.float64)
+    size = tuple(int(s) for s in size)
+    if map_type is None:
+        map_type = UNDISTORTION_MAP_TYPE
+    key = ('undistortion', camera, tuple(camera_matrix.ravel()), tuple(distortion_coeffs), size, map_type)
+    def create():
+        map_dir = undistortion_map_dir()
+        if map_dir is not None:
+            map_file = os.path.join(map_dir, 'undistort-{}.npz'.format(hashlib.sha1(repr(key).encode()).hexdigest()))
+            if os.path.isfile(map_file):
+                with np.load(map_file) as maps:
+                    return maps['map1'], maps['map2']
+        new_cam_mat, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, distortion_coeffs, size, 1)
+        map1, map2 = cv2.initUndistortRectifyMap(camera_matrix,
+                                                 distortion_coeffs,
+                                                 np.eye(3),
+                                                 new_cam_mat,
+                                                 size,
+                                                 map_type)
+        if map_dir is not None:
+            # write to a temporary file first so other processes never read a partial file
+            if not os.path.isdir(map_dir):
+                os.makedirs(map_dir)
+            tmp_file = '{}.{}.tmp'.format(map_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, map1=map1, map2=map2)
+            os.replace(tmp_file, map_file)
+        return map1, map2
+    return radiometry.get_cache().get(key, create)
 
 def normalize(im):
     width, height = im.shape
@@ -97,7 +153,7 @@ def align_capture(capture, ref_index=4, warp_mode=cv2.MOTION_AFFINE, max_iterati
     best results will be AFFINE and HOMOGRAPHY, at the expense of speed
     '''
     # Match other bands to this reference image (index into capture.images[])
-    ref_img = capture.images[ref_index].undistorted(capture.images[ref_index].reflectance()).astype('float32')
+    ref_img = radiometry.reflectance_values(capture.images[ref_index].undistorted(capture.images[ref_index].reflectance())).astype('float32')
     alignment_pairs = []
     for img in capture.images:
         alignment_pairs.append({'warp_mode': warp_mode,
@@ -106,7 +162,7 @@ def align_capture(capture, ref_index=4, warp_mode=cv2.MOTION_AFFINE, max_iterati
                                 'ref_index':ref_index,
                                 'ref_image': ref_img, 
                                 'match_index':img.band_index,
-                                'match_image':img.undistorted(img.reflectance()).astype('float32')})
+                                'match_image':radiometry.reflectance_values(img.undistorted(img.reflectance())).astype('float32')})
 
     warp_matrices = [None]*len(alignment_pairs)
     
@@ -122,26 +178,29 @@ def align_capture(capture, ref_index=4, warp_mode=cv2.MOTION_AFFINE, max_iterati
     return warp_matrices, alignment_pairs
 
 #apply homography to create an aligned stack 
-def aligned_capture(warp_matrices, alignment_pairs, dimension_tuple):
+def aligned_capture(warp_matrices, alignment_pairs, dimension_tuple, dtype=None):
+    ''' dtype overrides the pixel dtype policy of micasense.radiometry for the
+    aligned reflectance stack '''
     height, width = alignment_pairs[0]['ref_image'].shape
-    im_aligned = np.zeros((height,width,len(warp_matrices)), dtype=np.float32 )
+    im_aligned = np.zeros((height,width,len(warp_matrices)), dtype=radiometry.output_dtype(dtype, reflectance=True))
     
     for i in range(0,len(warp_matrices)):
         warp_mode = alignment_pairs[i]['warp_mode']
         
         if alignment_pairs[i]['match_index'] == alignment_pairs[i]['ref_index']:
-            im_aligned[:,:,i] = alignment_pairs[i]['match_image']
+            warped = alignment_pairs[i]['match_image']
         else:
             if warp_mode != cv2.MOTION_HOMOGRAPHY:
-                im_aligned[:,:,i] = cv2.warpAffine(alignment_pairs[i]['match_image'], 
-                                                warp_matrices[i], 
-                                                (width,height), 
-                                                flags=cv2.INTER_LANCZOS4 + cv2.WARP_INVERSE_MAP)
+                warped = cv2.warpAffine(alignment_pairs[i]['match_image'], 
+                                        warp_matrices[i], 
+                                        (width,height), 
+                                        flags=cv2.INTER_LANCZOS4 + cv2.WARP_INVERSE_MAP)
             else:
-                im_aligned[:,:,i] = cv2.warpPerspective(alignment_pairs[i]['match_image'], 
-                                                    warp_matrices[i], 
-                                                    (width,height), 
-                                                    flags=cv2.INTER_LANCZOS4 + cv2.WARP_INVERSE_MAP)
+                warped = cv2.warpPerspective(alignment_pairs[i]['match_image'], 
+                                             warp_matrices[i], 
+                                             (width,height), 
+                                             flags=cv2.INTER_LANCZOS4 + cv2.WARP_INVERSE_MAP)
+        im_aligned[:,:,i] = radiometry.convert(warped, dtype, reflectance=True)
     (left, top, w, h) = tuple(int(i) for i in dimension_tuple)
     im_cropped = im_aligned[top:top+h, left:left+w][:]
 
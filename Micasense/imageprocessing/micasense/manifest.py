@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Processing manifest of batch runs
+
+    Records, in a single SQLite file, each raw image converted by a batch run:
+    the size and modification time of the raw image, its band and the
+    radiance to reflectance factor used, the configuration of the run (code
+    version, pixel dtype, TIFF options) and the size, modification time and
+    SHA-256 checksum of the reflectance image written.  A re-run skips the
+    images whose record still matches, and redoes those whose raw image,
+    calibration factor or configuration changed or whose output is missing
+    or was modified.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import micasense.metacache as metacache
+
+def checksum(filename):
+    ''' The SHA-256 hex digest of a file '''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def config_key(config):
+    ''' The canonical text of a JSON serializable run configuration '''
+    return json.dumps(config, sort_keys=True)
+
+class Manifest(object):
+    ''' SQLite record of the reflectance images written by batch runs, keyed by the
+    absolute path of their raw image.  Like metacache.MetadataCache, one connection is
+    opened per process and shared by its threads. '''
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__connection = None
+
+    def __connect(self):
+        if self.__connection is None or self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__connection = sqlite3.connect(self.path, timeout=metacache.LOCK_TIMEOUT,
+                                                check_same_thread=False)
+            self.__connection.execute('PRAGMA journal_mode=WAL')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS outputs ('
+                                      'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                                      'band TEXT, factor REAL, config TEXT, output TEXT, '
+                                      'output_size INTEGER, output_mtime_ns INTEGER, checksum TEXT)')
+            self.__connection.commit()
+        return self.__connection
+
+    def current(self, jobs, calibration, config):
+        ''' The (raw image, reflectance image) jobs whose reflectance image is up to date for
+        the {band: factor} calibration and the run configuration config '''
+        config = config_key(config)
+        with self.__lock:
+            rows = self.__connect().execute('SELECT path, size, mtime_ns, band, factor, config, output, '
+                                            'output_size, output_mtime_ns FROM outputs').fetchall()
+        records = {row[0]: row[1:] for row in rows}
+        up_to_date = []
+        for source, output in jobs:
+            path, size, mtime_ns = metacache.file_key(source)
+            record = records.get(path)
+            if record is None or record[:2] != (size, mtime_ns) or record[4] != config \
+                    or record[5] != os.path.abspath(output) or calibration.get(record[2]) != record[3]:
+                continue
+            try:
+                _, output_size, output_mtime_ns = metacache.file_key(output)
+            except OSError:
+                continue
+            if record[6:] == (output_size, output_mtime_ns):
+                up_to_date.append((source, output))
+        return up_to_date
+
+    def record(self, records, calibration, config):
+        ''' Store the (raw image, reflectance image, band) records of written reflectance
+        images, converted with the {band: factor} calibration and the run configuration config '''
+        config = config_key(config)
+        rows = []
+        for source, output, band in records:
+            path, size, mtime_ns = metacache.file_key(source)
+            output_path, output_size, output_mtime_ns = metacache.file_key(output)
+            rows.append((path, size, mtime_ns, band, calibration[band], config,
+                         output_path, output_size, output_mtime_ns, checksum(output)))
+        with self.__lock:
+            connection = self.__connect()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO outputs (path, size, mtime_ns, band, factor, '
+                                       'config, output, output_size, output_mtime_ns, checksum) '
+                                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def verify(self, output):
+        ''' True if the reflectance image output still has its recorded checksum '''
+        with self.__lock:
+            row = self.__connect().execute('SELECT checksum FROM outputs WHERE output=?',
+                                           (os.path.abspath(output),)).fetchone()
+        return row is not None and os.path.isfile(output) and row[0] == checksum(output)
+
+    def clear(self):
+        with self.__lock:
+            connection = self.__connect()
+            with connection:
+                connection.execute('DELETE FROM outputs')
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connect().execute('SELECT COUNT(*) FROM outputs').fetchone()[0]
+
+    def close(self):
+        with self.__lock:
+            if self.__connection is not None and self.__pid == os.getpid():
+                self.__connection.close()
+            self.__connection = None
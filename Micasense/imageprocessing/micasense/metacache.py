@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Persistent on-disk metadata cache
+
+    Stores the extracted exif dictionary of each image in a single SQLite file,
+    keyed by the absolute path of the image.  Each entry records the size and
+    modification time of the file it was extracted from, and is ignored (and
+    later replaced) once the file changes.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+
+# how long to wait for another process holding a write lock on the cache
+LOCK_TIMEOUT = 60.0
+
+def file_key(filename):
+    ''' (absolute path, size, modification time in ns) identifying the current contents of a file '''
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+class MetadataCache(object):
+    ''' SQLite backed cache of image metadata dictionaries.
+
+    One connection is opened per process (a connection must not be used across
+    a fork), so the same cache may be shared by the workers of a multiprocessing pool. '''
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__connection = None
+
+    def __connect(self):
+        if self.__connection is None or self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+            self.__connection.execute('PRAGMA journal_mode=WAL')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                                      'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, exif TEXT)')
+            self.__connection.commit()
+        return self.__connection
+
+    def get(self, filename):
+        ''' return the cached exif dictionary of filename, or None if missing or stale '''
+        return self.get_many([filename])[0]
+
+    def get_many(self, filenames):
+        ''' return a list of cached exif dictionaries (None where missing or stale) in the order of filenames '''
+        keys = [file_key(filename) for filename in filenames]
+        results = []
+        with self.__lock:
+            connection = self.__connect()
+            for path, size, mtime_ns in keys:
+                row = connection.execute('SELECT size, mtime_ns, exif FROM metadata WHERE path=?',
+                                         (path,)).fetchone()
+                if row is None or row[0] != size or row[1] != mtime_ns:
+                    results.append(None)
+                else:
+                    results.append(json.loads(row[2]))
+        return results
+
+    def put(self, filename, exif):
+        self.put_many([filename], [exif])
+
+    def put_many(self, filenames, exifs):
+        ''' store the exif dictionaries of filenames, replacing any previous entries '''
+        rows = [file_key(filename) + (json.dumps(exif),) for filename, exif in zip(filenames, exifs)]
+        with self.__lock:
+            connection = self.__connect()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO metadata (path, size, mtime_ns, exif) '
+                                       'VALUES (?, ?, ?, ?)', rows)
+
+    def clear(self):
+        with self.__lock:
+            connection = self.__connect()
+            with connection:
+                connection.execute('DELETE FROM metadata')
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connect().execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+
+    def close(self):
+        with self.__lock:
+            if self.__connection is not None and self.__pid == os.getpid():
+                self.__connection.close()
+            self.__connection = None
@@ -25,31 +25,288 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import exiftool
 from datetime import datetime, timedelta
+from contextlib import contextmanager
+import atexit
+import threading
 import pytz
 import os
+import micasense.tiffreader as tiffreader
+import micasense.metacache as metacache
+
+# metadata extraction backends: 'exiftool' runs the exiftool program, 'native'
+# parses the TIFF tags and XMP packet in-process with micasense.tiffreader
+BACKENDS = ('exiftool', 'native')
+_backend = None
+
+def set_backend(backend):
+    ''' Set the default metadata backend of this process; None restores the default '''
+    if backend is not None and backend not in BACKENDS:
+        raise ValueError("Unknown metadata backend {}, use one of {}".format(backend, BACKENDS))
+    global _backend
+    _backend = backend
+
+def get_backend(backend=None):
+    ''' Resolve the metadata backend from the argument, set_backend() or the
+    metadatabackend environment variable, in that order.  Defaults to exiftool. '''
+    if backend is None:
+        backend = _backend
+    if backend is None:
+        backend = os.environ.get('metadatabackend', 'exiftool')
+    if backend not in BACKENDS:
+        raise ValueError("Unknown metadata backend {}, use one of {}".format(backend, BACKENDS))
+    return backend
+
+def exiftool_path(exiftoolPath=None):
+    ''' Resolve the exiftool executable from the argument or the exiftoolpath environment variable '''
+    if exiftoolPath is not None:
+        return exiftoolPath
+    if os.environ.get('exiftoolpath') is not None:
+        return os.path.normpath(os.environ.get('exiftoolpath'))
+    return None
+
+class ExifToolSession(object):
+    ''' A stay-open exiftool process which may be shared between threads '''
+    def __init__(self, exiftoolPath=None):
+        self.exiftoolPath = exiftoolPath
+        self.refcount = 0
+        self.__lock = threading.Lock()
+        self.__exiftool = exiftool.ExifTool(exiftoolPath)
+        self.__exiftool.start()
+
+    def running(self):
+        return self.__exiftool.running
+
+    def get_metadata(self, filename):
+        with self.__lock:
+            return self.__exiftool.get_metadata(filename)
+
+    def get_metadata_batch(self, filenames):
+        with self.__lock:
+            return self.__exiftool.get_metadata_batch(filenames)
+
+    def execute(self, *params):
+        with self.__lock:
+            return self.__exiftool.execute(*params)
+
+    def execute_json(self, *params):
+        with self.__lock:
+            return self.__exiftool.execute_json(*params)
+
+    def terminate(self):
+        with self.__lock:
+            if self.__exiftool.running:
+                self.__exiftool.terminate()
+
+class ExifToolPool(object):
+    ''' Reference-counted pool of stay-open exiftool sessions, one per executable per process.
+
+    A session is started by the first acquire() and terminated when the last
+    reference is released.  Sessions inherited over a fork() belong to the parent
+    and are never used or terminated by the child, which starts its own. '''
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+        self.__sessions = {}
+
+    def __check_fork(self):
+        if self.__pid != os.getpid():
+            # the pipes of inherited sessions are shared with the parent process
+            self.__pid = os.getpid()
+            self.__sessions = {}
+
+    def acquire(self, exiftoolPath=None):
+        with self.__lock:
+            self.__check_fork()
+            session = self.__sessions.get(exiftoolPath)
+            if session is None or not session.running():
+                session = ExifToolSession(exiftoolPath)
+                self.__sessions[exiftoolPath] = session
+            session.refcount += 1
+            return session
+
+    def release(self, session):
+        with self.__lock:
+            self.__check_fork()
+            if self.__sessions.get(session.exiftoolPath) is not session:
+                return
+            session.refcount -= 1
+            if session.refcount <= 0:
+                del self.__sessions[session.exiftoolPath]
+                session.terminate()
+
+    def shutdown(self):
+        ''' terminate all sessions started by this process, regardless of their references '''
+        with self.__lock:
+            self.__check_fork()
+            sessions = list(self.__sessions.values())
+            self.__sessions = {}
+        for session in sessions:
+            session.terminate()
+
+    def active_sessions(self):
+        with self.__lock:
+            self.__check_fork()
+            return len(self.__sessions)
+
+_exiftool_pool = ExifToolPool()
+atexit.register(_exiftool_pool.shutdown)
+
+@contextmanager
+def exiftool_session(exiftoolPath=None):
+    ''' Hold a reference to this process's shared exiftool session for the duration of the block.
+    Wrap a loop over many files in this so that every Metadata created inside it
+    reuses one exiftool process instead of starting a new one per file. '''
+    session = _exiftool_pool.acquire(exiftool_path(exiftoolPath))
+    try:
+        yield session
+    finally:
+        _exiftool_pool.release(session)
+
+def hold_exiftool_session(exiftoolPath=None):
+    ''' Keep a shared exiftool session open until the current process exits.
+    Intended as (part of) a multiprocessing.Pool initializer, so that each worker
+    process keeps one session for its lifetime and shuts it down on exit.
+
+    If exiftool cannot be started, no session is held and None is returned: an
+    initializer that raises makes the Pool replace its workers forever, whereas the
+    first task to read metadata raises the error to the caller. '''
+    from multiprocessing.util import Finalize
+    if get_backend() != 'exiftool':
+        return None
+    try:
+        session = _exiftool_pool.acquire(exiftool_path(exiftoolPath))
+    except (OSError, ValueError):
+        return None
+    Finalize(None, _exiftool_pool.release, args=(session,), exitpriority=10)
+    return session
+
+def shutdown_exiftool():
+    ''' Terminate all shared exiftool sessions of the current process '''
+    _exiftool_pool.shutdown()
+
+# number of files passed to exiftool in a single get_metadata_batch round-trip
+BATCH_SIZE = 256
+
+# the tags read by Image, Capture and utils; a scan extracts only these
+SCAN_TAGS = (
+    'EXIF:Make', 'EXIF:Model', 'EXIF:Software',
+    'EXIF:ImageWidth', 'EXIF:ImageHeight', 'EXIF:BitsPerSample', 'EXIF:BlackLevel',
+    'EXIF:DateTimeOriginal', 'EXIF:SubSecTime', 'EXIF:ExposureTime', 'EXIF:ISOSpeed',
+    'EXIF:FocalPlaneXResolution', 'EXIF:FocalPlaneYResolution',
+    'EXIF:GPSLatitude', 'EXIF:GPSLatitudeRef', 'EXIF:GPSLongitude', 'EXIF:GPSLongitudeRef',
+    'EXIF:GPSAltitude',
+    'XMP:CaptureId', 'XMP:FlightId', 'XMP:Serial', 'XMP:BandName', 'XMP:RigCameraIndex',
+    'XMP:CentralWavelength', 'XMP:WavelengthFWHM', 'XMP:RadiometricCalibration',
+    'XMP:DarkRowValue', 'XMP:VignettingCenter', 'XMP:VignettingPolynomial',
+    'XMP:PerspectiveDistortion', 'XMP:PrincipalPoint',
+    'XMP:PerspectiveFocalLength', 'XMP:PerspectiveFocalLengthUnits',
+    'XMP:Irradiance', 'XMP:SpectralIrradiance', 'XMP:Yaw', 'XMP:Pitch', 'XMP:Roll',
+)
+# exiftool options of a scan: -fast2 skips the maker notes and the trailer of the file
+SCAN_OPTIONS = ('-fast2',)
+
+def scan_subset(exif):
+    ''' The SCAN_TAGS subset of a full exif dictionary '''
+    subset = {tag: exif[tag] for tag in SCAN_TAGS if tag in exif}
+    if 'SourceFile' in exif:
+        subset['SourceFile'] = exif['SourceFile']
+    return subset
+
+_cache = None
+
+def set_cache(path):
+    ''' Enable the persistent metadata cache of this process, stored in the SQLite file
+    at path.  None disables the cache. '''
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None if path is None else metacache.MetadataCache(path)
+
+def get_cache():
+    ''' The metadata cache set by set_cache() or the metadatacache environment variable, or None '''
+    global _cache
+    if _cache is None and os.environ.get('metadatacache') is not None:
+        _cache = metacache.MetadataCache(os.environ.get('metadatacache'))
+    return _cache
+
+def extract_metadata(filenames, exiftoolPath=None, batch_size=BATCH_SIZE, backend=None, scan=False):
+    ''' Return the exif dictionaries of filenames, in order, from the metadata cache
+    where possible and otherwise from the metadata backend.  With scan=True only
+    the SCAN_TAGS are returned, and the partial results are not cached. '''
+    cache = get_cache()
+    exifs = cache.get_many(filenames) if cache is not None else [None] * len(filenames)
+    missing = [filename for filename, exif in zip(filenames, exifs) if exif is None]
+    if scan:
+        exifs = [scan_subset(exif) if exif is not None else None for exif in exifs]
+    if not missing:
+        return exifs
+    if get_backend(backend) == 'native':
+        extracted = tiffreader.read_metadata_batch(missing)
+        if scan:
+            extracted = [scan_subset(exif) for exif in extracted]
+    else:
+        extracted = []
+        tag_options = list(SCAN_OPTIONS) + ['-' + tag for tag in SCAN_TAGS]
+        with exiftool_session(exiftoolPath) as exift:
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start+batch_size]
+                if scan:
+                    results = exift.execute_json(*(tag_options + batch))
+                else:
+                    results = exift.get_metadata_batch(batch)
+                if len(results) != len(batch):
+                    raise IOError("exiftool returned {} results for {} files".format(len(results), len(batch)))
+                extracted += results
+    if cache is not None and not scan:
+        cache.put_many(missing, extracted)
+    extracted = iter(extracted)
+    return [exif if exif is not None else next(extracted) for exif in exifs]
 
 class Metadata(object):
     ''' Container for Micasense image metadata'''
-    def __init__(self, filename, exiftoolPath=None):
+    def __init__(self, filename, exiftoolPath=None, exif=None, backend=None, scan=False):
+        ''' With scan=True only the SCAN_TAGS are extracted; any other tag is fetched
+        on demand, with the rest of the full tag set, the first time it is read '''
         self.xmpfile = None
-        if exiftoolPath is not None:
-            self.exiftoolPath = exiftoolPath
-        elif os.environ.get('exiftoolpath') is not None:
-            self.exiftoolPath = os.path.normpath(os.environ.get('exiftoolpath'))
-        else:
-            self.exiftoolPath = None
+        self.filename = filename
+        self.exiftoolPath = exiftool_path(exiftoolPath)
+        self.backend = backend
+        self.scan = scan
         if not os.path.isfile(filename):
             raise IOError("Input path is not a file")
-        with exiftool.ExifTool(self.exiftoolPath) as exift:
-            self.exif = exift.get_metadata(filename)
+        if exif is None:
+            exif = extract_metadata([filename], self.exiftoolPath, backend=backend, scan=scan)[0]
+        self.exif = exif
+
+    @classmethod
+    def from_files(cls, filenames, exiftoolPath=None, batch_size=BATCH_SIZE, backend=None, scan=False):
+        ''' Extract the metadata of many files with one exiftool round-trip per batch
+        of batch_size files.  Returns a list of Metadata in the order of filenames '''
+        exiftoolPath = exiftool_path(exiftoolPath)
+        filenames = list(filenames)
+        for filename in filenames:
+            if not os.path.isfile(filename):
+                raise IOError("Input path is not a file: {}".format(filename))
+        exifs = extract_metadata(filenames, exiftoolPath, batch_size, backend, scan)
+        return [cls(filename, exiftoolPath, exif=exif, backend=backend, scan=scan)
+                for filename, exif in zip(filenames, exifs)]
+
+    def fetch_all(self):
+        ''' Replace the tags of a scan with the full tag set of the file '''
+        if self.scan:
+            self.exif = extract_metadata([self.filename], self.exiftoolPath, backend=self.backend)[0]
+            self.scan = False
+        return self.exif
 
     def get_all(self):
         ''' Get all extracted metadata items '''
-        return self.exif
+        return self.fetch_all()
 
     def get_item(self, item, index=None):
         ''' Get metadata item by Namespace:Parameter'''
         val = None
+        if self.scan and item not in self.exif and item not in SCAN_TAGS:
+            self.fetch_all()
         try:
             val = self.exif[item]
             if index is not None:
@@ -137,6 +394,9 @@ class Metadata(object):
     def firmware_version(self):
         return self.get_item('EXIF:Software')
 
+    def camera_serial(self):
+        return self.get_item('XMP:Serial')
+
     def band_name(self):
         return self.get_item('XMP:BandName')
     
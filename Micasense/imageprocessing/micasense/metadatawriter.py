@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Metadata transfer to processed images
+
+    Copies the EXIF and XMP tags of each source image onto the image derived
+    from it (e.g. a reflectance TIFF), using the shared stay-open exiftool
+    session of micasense.metadata.  Outputs are written in batches: all
+    outputs of one source directory that keep the source file name are
+    updated by a single exiftool command.  MetadataWriter does this on a
+    background thread, so tags are written while later images are processed.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import re
+import queue
+import threading
+import micasense.metadata as metadata
+
+# the tags copied from the source image, as in `exiftool -tagsFromFile`
+TRANSFER_TAGS = ('-file:all', '-iptc:all', '-exif:all', '-xmp', '-Composite:all')
+
+UPDATED = re.compile(r'(\d+) image files? updated')
+
+def transfer_commands(pairs):
+    ''' Group (source, output) pairs into exiftool argument lists.  Outputs which
+    have the same base name as their source, and whose sources share a directory
+    and extension, are updated together using a %f/%e -tagsFromFile pattern;
+    any other pair gets a command of its own.  Returns a list of (args, outputs) '''
+    groups = {}
+    commands = []
+    for source, output in pairs:
+        source_dir, source_name = os.path.split(os.path.abspath(source))
+        base, ext = os.path.splitext(source_name)
+        if os.path.splitext(os.path.basename(output))[0] == base:
+            groups.setdefault((source_dir, ext), []).append(output)
+        else:
+            commands.append((['-tagsFromFile', source], [output]))
+    for (source_dir, ext), outputs in groups.items():
+        pattern = os.path.join(source_dir, '%f' + ext)
+        commands.append((['-tagsFromFile', pattern], outputs))
+    return [(args + list(TRANSFER_TAGS) + ['-overwrite_original'] + outputs, outputs)
+            for args, outputs in commands]
+
+def transfer_metadata(pairs, exiftoolPath=None):
+    ''' Copy the tags of each source onto its output, for an iterable of
+    (source, output) pairs.  Raises IOError if exiftool does not update every output '''
+    with metadata.exiftool_session(exiftoolPath) as exift:
+        for args, outputs in transfer_commands(pairs):
+            result = exift.execute(*[os.fsencode(arg) for arg in args]).decode('utf-8', 'replace')
+            match = UPDATED.search(result)
+            updated = int(match.group(1)) if match is not None else 0
+            if updated != len(outputs):
+                raise IOError("exiftool updated {} of {} files: {}".format(updated, len(outputs), result.strip()))
+
+class MetadataWriter(object):
+    ''' Transfer metadata on a background thread, in batches of up to batch_size
+    outputs, calling on_transferred (if given) with each batch of (source, output)
+    pairs once it has been transferred.  Errors are raised from flush() or close(). '''
+    def __init__(self, exiftoolPath=None, batch_size=metadata.BATCH_SIZE, on_transferred=None):
+        self.exiftoolPath = exiftoolPath
+        self.batch_size = batch_size
+        self.on_transferred = on_transferred
+        self.__queue = queue.Queue()
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __run(self):
+        closed = False
+        while not closed:
+            batch = [self.__queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            pairs = [pair for pair in batch if pair is not None]
+            closed = len(pairs) < len(batch)
+            try:
+                if pairs and self.__error is None:
+                    transfer_metadata(pairs, self.exiftoolPath)
+                    if self.on_transferred is not None:
+                        self.on_transferred(pairs)
+            except Exception as e:
+                self.__error = e
+            finally:
+                for _ in batch:
+                    self.__queue.task_done()
+
+    def __raise(self):
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    def submit(self, source, output):
+        ''' Queue the transfer of the tags of source onto output, once output has been written '''
+        if not self.__thread.is_alive():
+            raise RuntimeError("MetadataWriter is closed")
+        self.__raise()
+        self.__queue.put((source, output))
+
+    def flush(self):
+        ''' Wait until all submitted outputs have been written '''
+        self.__queue.join()
+        self.__raise()
+
+    def close(self):
+        ''' Write the remaining outputs and stop the background thread '''
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        self.__raise()
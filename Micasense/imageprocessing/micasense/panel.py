@@ -27,6 +27,8 @@ import math
 import numpy as np
 import cv2
 import re
+import micasense.radiometry as radiometry
+import micasense.plotutils as plotutils
 import pyzbar.pyzbar as pyzbar
 
 from skimage import measure
@@ -152,7 +154,7 @@ class Panel(object):
             print("First calculate the reflectance image by providing a\n band specific irradiance to the calling image.reflectance(irradnace)")
         undistorted_refl = self.image.undistorted(reflectance_image)
 
-        mean, _, _, _ = self.region_stats(reflectance_image,
+        mean, _, _, _ = self.region_stats(radiometry.reflectance_values(reflectance_image),
                                           self.panel_corners())
         return mean
 
@@ -175,6 +177,8 @@ class Panel(object):
 
     def plot(self, figsize=(14,14)):
         display_img = self.plot_image()
+        if plotutils.deferred('panel', 1, 1, [display_img], figsize=figsize, colorbar=False):
+            return None, None
         fig, ax = plt.subplots(figsize=figsize)
         ax.imshow(display_img)
         plt.tight_layout()
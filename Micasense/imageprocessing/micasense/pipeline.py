@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Three stage pipeline of reader, compute and writer pools
+
+    Runs each item through read(item) on a pool of reader threads,
+    compute(data) on a pool of compute workers and write(item, result) on a
+    pool of writer threads, so that reading from disk, computing and writing
+    to disk overlap instead of taking turns.  The stages are connected by
+    bounded queues: once queue_size items wait for the next stage the stage
+    before it waits, so a slow stage holds back the others rather than
+    filling memory, and a run takes about as long as its slowest stage.
+
+    With processes, compute runs on a multiprocessing pool, so it scales
+    across cpus even where it holds the GIL (building Metadata, the Python
+    between numpy calls); data and results go through pipes, so they should
+    be small (e.g. a path rather than pixels).  Otherwise compute runs on
+    threads, which hand arrays on without copying them but only use every
+    cpu while compute is in code releasing the GIL, as numpy, OpenCV and
+    zlib do.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import queue
+import threading
+import multiprocessing
+
+# threads reading and writing files
+READERS = 2
+WRITERS = 2
+
+# marks the end of the items
+_DONE = object()
+
+class Pipeline(object):
+    ''' Reader, compute and writer pools connected by queues of at most queue_size
+    items (twice the number of compute workers if None).  workers is the number of
+    compute threads, or of worker processes if processes, one per cpu if None.  With
+    processes, compute, its data and its results must be picklable, and each worker
+    process runs initializer(*initargs) (if given) when it starts. '''
+    def __init__(self, read, compute, write, readers=READERS, workers=None, writers=WRITERS,
+                 queue_size=None, processes=False, initializer=None, initargs=()):
+        self.read = read
+        self.compute = compute
+        self.write = write
+        self.readers = readers
+        self.workers = workers or multiprocessing.cpu_count()
+        self.writers = writers
+        self.queue_size = queue_size or 2 * self.workers
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def run(self, items, progress_callback=None):
+        ''' Run each of items through the stages, calling progress_callback (if given) with
+        the fraction of items written after each write.  Returns the results of write(), in
+        the order they completed.  The first error raised by any stage stops the pipeline
+        and is raised here. '''
+        items = list(items)
+        if not items:
+            return []
+        pending = iter(items)
+        pending_lock = threading.Lock()
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        failed = threading.Event()
+        errors = []
+        written = []
+        written_lock = threading.Lock()
+
+        def next_item():
+            with pending_lock:
+                return next(pending, _DONE)
+
+        def done(result):
+            with written_lock:
+                written.append(result)
+                if progress_callback is not None:
+                    progress_callback(float(len(written))/float(len(items)))
+
+        def stage(get, process, put):
+            # after a failure the entries are still taken, so that no stage waits on a full queue
+            while True:
+                entry = get()
+                if entry is _DONE:
+                    return
+                if failed.is_set():
+                    continue
+                try:
+                    put(process(entry))
+                except Exception as e:
+                    errors.append(e)
+                    failed.set()
+
+        def start(count, *args):
+            threads = [threading.Thread(target=stage, args=args) for _ in range(count)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            return threads
+
+        # started before any thread, so forked workers don't inherit held locks
+        pool = multiprocessing.Pool(self.workers, self.initializer, self.initargs) if self.processes else None
+        if pool is not None:
+            # each compute thread waits on one task of the pool at a time
+            compute = lambda data: pool.apply(self.compute, (data,))
+        else:
+            compute = self.compute
+        readers = start(self.readers, next_item, lambda item: (item, self.read(item)), read_queue.put)
+        workers = start(self.workers, read_queue.get, lambda entry: (entry[0], compute(entry[1])),
+                        write_queue.put)
+        writers = start(self.writers, write_queue.get, lambda entry: self.write(*entry), done)
+        try:
+            for threads, next_queue, consumers in ((readers, read_queue, workers),
+                                                   (workers, write_queue, writers)):
+                for thread in threads:
+                    thread.join()
+                # each thread of the next stage stops at the first _DONE it takes
+                for _ in consumers:
+                    next_queue.put(_DONE)
+            for thread in writers:
+                thread.join()
+        except BaseException:
+            failed.set()
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if errors:
+            raise errors[0]
+        return written
@@ -3,6 +3,15 @@
 """
 MicaSense Plotting Utilities
 
+    The plot mode, set with set_mode() or the plotmode environment variable,
+    decides what the plotting functions do:
+      'show'     - draw and show the figure (the default)
+      'headless' - skip plotting entirely, for batch processing nodes
+      'png'      - queue a downsampled copy of the images to a background thread,
+                   which renders them with the Agg backend and writes them as png
+                   files to the plotdir directory (default 'diagnostics')
+    In 'headless' and 'png' modes the functions return (None, None).
+
 Copyright 2017 MicaSense, Inc.
 
 Permission is hereby granted, free of charge, to any person obtaining a copy of
@@ -23,12 +32,155 @@ IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import os
+import re
+import math
+import atexit
+import itertools
+import threading
+import queue
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from mpl_toolkits.mplot3d import Axes3D
 
+PLOT_MODES = ('show', 'headless', 'png')
+# longest side of the images of a png diagnostic
+DIAGNOSTIC_SIZE = 512
+# diagnostics waiting to be written, beyond which new ones are dropped
+DIAGNOSTIC_QUEUE = 64
+
+def downsample(img, max_size=DIAGNOSTIC_SIZE):
+    ''' A copy of an image, decimated so its longest side is at most max_size '''
+    step = int(math.ceil(max(img.shape[:2]) / float(max_size)))
+    return img[::max(step, 1), ::max(step, 1)].copy()
+
+def render(path, rows, cols, images, titles=None, figsize=None, colorbar=True,
+           overlay=None, vmin=None, vmax=None, overlay_alpha=1.0):
+    ''' Draw images in rows x cols subplots (over overlay images, if given) with the Agg
+    backend and save the figure as a png.  Does not use pyplot, so it is safe on any thread. '''
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(rows, cols, squeeze=False)
+    for i in range(cols*rows):
+        axis = axes[int(i/cols)][int(i%cols)]
+        if i >= len(images):
+            axis.axis('off')
+            continue
+        if overlay is not None:
+            axis.imshow(overlay[i])
+            plotted = axis.imshow(images[i], vmin=vmin, vmax=vmax, alpha=overlay_alpha)
+        else:
+            plotted = axis.imshow(images[i], vmin=vmin, vmax=vmax)
+        if titles is not None:
+            axis.set_title(titles[i])
+        if colorbar:
+            divider = make_axes_locatable(axis)
+            cax = divider.append_axes("right", size="3%", pad=0.05)
+            fig.colorbar(plotted, cax=cax)
+    fig.tight_layout()
+    fig.savefig(path)
+
+class DiagnosticWriter(object):
+    ''' Write diagnostic figures as numbered png files in directory, on a background
+    thread.  Submitting never waits: once max_queued figures are waiting, new ones are
+    dropped (and counted in dropped). '''
+    def __init__(self, directory, max_queued=DIAGNOSTIC_QUEUE):
+        self.directory = directory
+        self.dropped = 0
+        self.__count = itertools.count(1)
+        self.__queue = queue.Queue(maxsize=max_queued)
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        while True:
+            task = self.__queue.get()
+            try:
+                if task is None:
+                    return
+                path, args, kwargs = task
+                render(path, *args, **kwargs)
+            except Exception as e:
+                print("Could not write diagnostic {}: {}".format(path, e))
+            finally:
+                self.__queue.task_done()
+
+    def submit(self, title, rows, cols, images, **kwargs):
+        ''' Queue a figure of rows x cols images, downsampled, for render() '''
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(title or 'plot')).strip('_')
+        path = os.path.join(self.directory, '{:05d}_{}.png'.format(next(self.__count), name))
+        images = [downsample(img) for img in images]
+        if kwargs.get('overlay') is not None:
+            kwargs['overlay'] = [downsample(img) for img in kwargs['overlay']]
+        try:
+            self.__queue.put_nowait((path, (rows, cols, images), kwargs))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        ''' Wait until the queued figures have been written '''
+        self.__queue.join()
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+
+_mode = None
+_directory = None
+_writer = None
+_lock = threading.Lock()
+
+def set_mode(mode, directory=None):
+    ''' Set the plot mode of this process, one of PLOT_MODES, or None to use the plotmode
+    environment variable.  directory is where 'png' mode writes, overriding plotdir. '''
+    global _mode, _directory, _writer
+    if mode is not None and mode not in PLOT_MODES:
+        raise ValueError("Unknown plot mode {}, use one of {}".format(mode, PLOT_MODES))
+    with _lock:
+        _mode = mode
+        _directory = directory
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+def get_mode():
+    if _mode is not None:
+        return _mode
+    return os.environ.get('plotmode', 'show')
+
+def diagnostic_writer():
+    ''' The DiagnosticWriter of 'png' mode, started on first use '''
+    global _writer
+    with _lock:
+        if _writer is None:
+            directory = _directory or os.environ.get('plotdir', 'diagnostics')
+            os.makedirs(directory, exist_ok=True)
+            _writer = DiagnosticWriter(directory)
+            atexit.register(_writer.close)
+        return _writer
+
+def flush_diagnostics():
+    ''' Wait until all queued png diagnostics have been written '''
+    if _writer is not None:
+        _writer.flush()
+
+def deferred(title, rows, cols, images, **kwargs):
+    ''' Handle a plot in 'headless' or 'png' mode; returns False in 'show' mode '''
+    mode = get_mode()
+    if mode == 'show':
+        return False
+    if mode == 'png':
+        diagnostic_writer().submit(title, rows, cols, images, **kwargs)
+    return True
+
 def plotwithcolorbar(img, title=None, figsize=None, vmin=None, vmax=None):
     ''' Plot an image with a colorbar '''
+    if deferred(title, 1, 1, [img], titles=[title], figsize=figsize, vmin=vmin, vmax=vmax):
+        return None, None
     fig, axis = plt.subplots(1, 1, figsize=figsize)
     rad2 = axis.imshow(img, vmin=vmin, vmax=vmax)
     axis.set_title(title)
@@ -41,6 +193,8 @@ def plotwithcolorbar(img, title=None, figsize=None, vmin=None, vmax=None):
 
 def subplotwithcolorbar(rows, cols, images, titles=None, figsize=None):
     ''' Plot a set of images in subplots '''
+    if deferred(titles[0] if titles else None, rows, cols, images, titles=titles, figsize=figsize):
+        return None, None
     fig, axes = plt.subplots(rows, cols, figsize=figsize)
     for i in range(cols*rows):
         column = int(i%cols)
@@ -60,6 +214,9 @@ def subplotwithcolorbar(rows, cols, images, titles=None, figsize=None):
 
 def plot_overlay_withcolorbar(imgbase, imgcolor, title=None, figsize=None, vmin=None, vmax=None, overlay_alpha=1.0):
     ''' Plot an image with a colorbar '''
+    if deferred(title, 1, 1, [imgcolor], titles=[title], figsize=figsize, overlay=[imgbase],
+                vmin=vmin, vmax=vmax, overlay_alpha=overlay_alpha):
+        return None, None
     fig, axis = plt.subplots(1, 1, figsize=figsize)
     base = axis.imshow(imgbase)
     rad2 = axis.imshow(imgcolor, vmin=vmin, vmax=vmax, alpha=overlay_alpha)
@@ -73,6 +230,9 @@ def plot_overlay_withcolorbar(imgbase, imgcolor, title=None, figsize=None, vmin=
 
 def subplot(rows, cols, images, titles=None, figsize=None):
     ''' Plot a set of images in subplots '''
+    if deferred(titles[0] if titles else None, rows, cols, images, titles=titles, figsize=figsize,
+                colorbar=False):
+        return None, None
     fig, axes = plt.subplots(rows, cols, figsize=figsize)
     for i in range(cols*rows):
         column = int(i%cols)
@@ -96,7 +256,9 @@ def colormap(cmap):
 import numpy as np
 def plot_ned_vector3d(x,y,z, u=0,v=0,w=0, title=None, figsize=(8,5)):
     '''Create a 3d plot of a North-East-Down vector. XYZ is the (tip of the) vector,
-       uvw is the base location of the vector '''
+       uvw is the base location of the vector.  Not drawn in 'headless' or 'png' mode. '''
+    if get_mode() != 'show':
+        return None, None
     fig = plt.figure(figsize=figsize)
     ax = fig.gca(projection='3d')
     ax.quiver(u, v, w, x, y, z, color='r')
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Shared radiometric correction maps
+
+    The vignette map of an image depends only on the vignette center and
+    polynomial of its band and on the image size, and the row gradient
+    correction only on the radiometric calibration, the exposure time and
+    the image height.  These are computed once and kept in a process-wide,
+    size-bounded cache, so every image of a band taken with the same camera
+    shares one map per compute dtype: float32, or float64 under the float64
+    policy.  Maps are in image (row-major) orientation, and are read-only
+    because they are shared.
+
+    calibrate() applies the black level, vignette, row gradient and a
+    radiometric scale to a raw image in a single float buffer; it is the
+    one radiance/intensity path used by micasense.image and micasense.utils.
+
+    The pixel dtype of processed images follows a policy set with set_dtype()
+    or the pixeldtype environment variable, and may be overridden per call:
+    float64 (computed in float64, for validation), float32 (the default),
+    float16, or uint16, which stores reflectance scaled by
+    UINT16_REFLECTANCE_SCALE and other images as float32.
+
+    calibrate_streaming() is the low memory variant of calibrate(): it works
+    through the image in blocks of rows, straight into a preallocated output,
+    and computes the vignette of each block instead of using the cache.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+PIXEL_DTYPES = ('float64', 'float32', 'float16', 'uint16')
+# scale of uint16 reflectance, so reflectances up to 2.0 can be stored
+UINT16_REFLECTANCE_SCALE = 32768.0
+_dtype = None
+
+def set_dtype(dtype):
+    ''' Set the default pixel dtype of this process; None restores the default '''
+    global _dtype
+    _dtype = None if dtype is None else get_dtype(dtype)
+
+def get_dtype(dtype=None):
+    ''' Resolve the pixel dtype name from the argument, set_dtype() or the pixeldtype
+    environment variable, in that order.  Defaults to float32. '''
+    if dtype is None:
+        dtype = _dtype
+    if dtype is None:
+        dtype = os.environ.get('pixeldtype', 'float32')
+    dtype = np.dtype(dtype).name
+    if dtype not in PIXEL_DTYPES:
+        raise ValueError("Unsupported pixel dtype {}, use one of {}".format(dtype, PIXEL_DTYPES))
+    return dtype
+
+def compute_dtype(dtype=None):
+    ''' The floating point type calculations are done in for a pixel dtype '''
+    return np.dtype(np.float64) if get_dtype(dtype) == 'float64' else np.dtype(np.float32)
+
+def output_dtype(dtype=None, reflectance=False):
+    ''' The dtype of an image (a reflectance image if reflectance) under a pixel dtype '''
+    dtype = get_dtype(dtype)
+    if dtype == 'uint16' and not reflectance:
+        return np.dtype(np.float32)
+    return np.dtype(dtype)
+
+def convert(image, dtype=None, reflectance=False):
+    ''' Convert a floating point image (a reflectance image if reflectance) to a pixel dtype '''
+    out = output_dtype(dtype, reflectance)
+    if image.dtype == out:
+        return image
+    if out == np.uint16:
+        scaled = np.multiply(image, UINT16_REFLECTANCE_SCALE, dtype=np.float32)
+        np.clip(scaled, 0, 65535, out=scaled)
+        return np.rint(scaled, out=scaled).astype(np.uint16)
+    return image.astype(out)
+
+def reflectance_values(image):
+    ''' Floating point reflectance of a reflectance image of any pixel dtype '''
+    if image.dtype == np.uint16:
+        return image / np.float32(UINT16_REFLECTANCE_SCALE)
+    return image
+
+# rows per block of calibrate_streaming()
+BLOCK_ROWS = 64
+
+# default size of the correction map cache; a 1280x960 float32 map is about 5MB
+CACHE_BYTES = 256 * 1024 * 1024
+
+def nbytes(array):
+    if isinstance(array, tuple):
+        return sum(a.nbytes for a in array)
+    return array.nbytes
+
+class CorrectionCache(object):
+    ''' Least recently used cache of read-only arrays, bounded by their total size in bytes '''
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.__lock = threading.Lock()
+        self.__arrays = OrderedDict()
+
+    def get(self, key, create):
+        ''' Return the array (or tuple of arrays) cached for key, calling create()
+        to build it if missing '''
+        with self.__lock:
+            array = self.__arrays.get(key)
+            if array is not None:
+                self.__arrays.move_to_end(key)
+                return array
+        array = create()
+        for a in array if isinstance(array, tuple) else (array,):
+            a.setflags(write=False)
+        with self.__lock:
+            if key not in self.__arrays:
+                self.__arrays[key] = array
+                self.nbytes += nbytes(array)
+                self.__evict()
+        return array
+
+    def peek(self, key):
+        ''' Return the array cached for key, or None, without creating it '''
+        with self.__lock:
+            return self.__arrays.get(key)
+
+    def __evict(self):
+        while self.nbytes > self.max_bytes and len(self.__arrays) > 1:
+            _, array = self.__arrays.popitem(last=False)
+            self.nbytes -= nbytes(array)
+
+    def resize(self, max_bytes):
+        with self.__lock:
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            self.__arrays.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self.__arrays)
+
+_cache = CorrectionCache(int(os.environ.get('correctioncache', CACHE_BYTES)))
+
+def get_cache():
+    return _cache
+
+def set_cache_size(max_bytes):
+    ''' Set the size bound of the correction map cache of this process, in bytes '''
+    _cache.resize(max_bytes)
+
+def clear_cache():
+    _cache.clear()
+
+def vignette_key(vignette_center, vignette_polynomial, width, height, dtype=None):
+    return ('vignette', tuple(float(c) for c in vignette_center),
+            tuple(float(c) for c in vignette_polynomial), width, height, compute_dtype(dtype).name)
+
+def vignette_map(vignette_center, vignette_polynomial, width, height, dtype=None):
+    ''' Get the (height, width) array to multiply each pixel by to correct for optical
+    vignetting, for the vignette center and polynomial of a band, in the compute_dtype()
+    of the pixel dtype dtype '''
+    def create():
+        return vignette_rows(vignette_center, vignette_polynomial, width, 0, height, dtype)
+    return _cache.get(vignette_key(vignette_center, vignette_polynomial, width, height, dtype), create)
+
+def vignette_rows(vignette_center, vignette_polynomial, width, start, stop, dtype=None):
+    ''' Compute rows start to stop of a vignette map in the compute_dtype() of dtype,
+    without the cache '''
+    # reverse the polynomial and append 1., so that we can call with numpy polyval
+    v_polynomial = np.array([float(c) for c in reversed(vignette_polynomial)] + [1.])
+    # distance of every pixel from the vignette center, built from one row and one column
+    x = np.arange(width, dtype=np.float64) - float(vignette_center[0])
+    y = np.arange(start, stop, dtype=np.float64)[:, np.newaxis] - float(vignette_center[1])
+    r = np.hypot(x, y)
+    # we divide by the polynomial so that image_corrected = image_original * vignette
+    return (1. / np.polyval(v_polynomial, r)).astype(compute_dtype(dtype))
+
+def row_gradient(radiometric_cal, exposure_time, height, dtype=None):
+    ''' Get the (height, 1) row gradient correction of an image, which broadcasts
+    across the columns of a (height, width) image, in the compute_dtype() of the
+    pixel dtype dtype '''
+    _, a2, a3 = [float(a) for a in radiometric_cal[:3]]
+    exposure_time = float(exposure_time)
+    dtype = compute_dtype(dtype)
+    def create():
+        y = np.arange(height, dtype=np.float64)[:, np.newaxis]
+        return (1.0 / (1.0 + a2 * y / exposure_time - a3 * y)).astype(dtype)
+    return _cache.get(('row_gradient', a2, a3, exposure_time, height, dtype.name), create)
+
+def calibrate(raw, black_level, vignette, row_gradient, scale=1.0, out=None, dtype=np.float32):
+    ''' Compute max(vignette * row_gradient * (raw - black_level), 0) * scale for a
+    raw image in image orientation, in place in one buffer of dtype (float32 or
+    float64).  With scale 1 the result is the corrected DN image; use scale_factors()
+    for radiance and intensity.  out may be an array of the shape of raw to write into. '''
+    if out is None:
+        out = np.empty(raw.shape, dtype=dtype)
+    np.subtract(raw, black_level, out=out, dtype=out.dtype)
+    np.multiply(out, vignette, out=out)
+    # the (height, 1) row gradient carries the scale, so this is the only other pass
+    np.multiply(out, (row_gradient * scale).astype(out.dtype), out=out)
+    np.maximum(out, 0, out=out)
+    return out
+
+def scale_factors(radiometric_cal, gain, exposure_time, bits_per_pixel):
+    ''' Scale of corrected DN to (radiance, intensity).  The radiometric calibration
+    is normalized to input values of max 1.0, hence the division by 2^bits. '''
+    max_raw_dn = float(2**bits_per_pixel)
+    intensity_scale = 1.0 / (gain * exposure_time * max_raw_dn)
+    return radiometric_cal[0] * intensity_scale, intensity_scale
+
+def calibrate_streaming(raw, black_level, vignette_center, vignette_polynomial, row_gradient, scale=1.0,
+                        out=None, block_rows=BLOCK_ROWS, dtype=None, reflectance=False):
+    ''' calibrate() a raw image block_rows rows at a time, straight into out.  The
+    vignette of each block is sliced from the cached vignette map if there is one, and
+    computed as it is used otherwise.  out is allocated in the pixel dtype (of a
+    reflectance image if reflectance) if None, and is converted to with convert().
+    Only a reflectance image may be written to a uint16 out; any other integer out
+    raises ValueError.  Besides out, only a few blocks of block_rows rows are allocated. '''
+    height, width = raw.shape
+    if out is None:
+        out = np.empty(raw.shape, dtype=output_dtype(dtype, reflectance))
+    if out.shape != raw.shape:
+        raise ValueError("Output shape {} does not match image shape {}".format(out.shape, raw.shape))
+    if out.dtype.kind != 'f' and not (reflectance and out.dtype == np.uint16):
+        raise ValueError("Cannot write {} image to output of dtype {}".format(
+            'a reflectance' if reflectance else 'an intensity or radiance', out.dtype))
+    compute = np.float64 if out.dtype == np.float64 else np.float32
+    scratch = None if out.dtype == compute else np.empty((block_rows, width), dtype=compute)
+    vignette_full = _cache.peek(vignette_key(vignette_center, vignette_polynomial, width, height, compute))
+    for start in range(0, height, block_rows):
+        stop = min(start + block_rows, height)
+        if vignette_full is not None:
+            vignette = vignette_full[start:stop]
+        else:
+            vignette = vignette_rows(vignette_center, vignette_polynomial, width, start, stop, compute)
+        if scratch is None:
+            calibrate(raw[start:stop], black_level, vignette, row_gradient[start:stop], scale, out=out[start:stop])
+        else:
+            block = calibrate(raw[start:stop], black_level, vignette, row_gradient[start:stop], scale,
+                              out=scratch[:stop-start])
+            out[start:stop] = convert(block, out.dtype.name, reflectance)
+    return out
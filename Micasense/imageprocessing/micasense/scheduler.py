@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Conversion of many flights on one shared pool of workers
+
+    Converts the raw images of several flights, each with its own calibration
+    panel images and output directory.  The panel images of all flights are
+    calibrated together on one pool of worker processes, then the raw images
+    of all flights are interleaved, one image of each flight in turn, into a
+    single micasense.pipeline.  Every flight progresses at the same rate, small
+    flights finish early, and no cpu waits for a large flight to finish before
+    starting on the next.  Each flight gets its own calibration.json, manifest
+    and reflectance images in its output directory, and its own progress.
+
+    python -m micasense.scheduler flights.json --panel panel.json
+
+    flights.json is a list of flights such as
+        [{"name": "field1", "input": "field1/raw", "output": "field1/reflectance",
+          "panels": ["field1/preflight", "field1/postflight"]}, ...]
+    where "panels" are panel images or folders of them, and a flight may also give
+    the reflectance of its "panel" (a {band name: reflectance} or a JSON file of one;
+    the --panel file by default), or a "calibration" JSON file of radiance to
+    reflectance factors to use instead of panel images.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+import itertools
+import micasense.batch as batch
+import micasense.calibration as calibration
+import micasense.pipeline as pipeline
+
+# name of the radiance to reflectance factors written to the output directory of each flight
+CALIBRATION_NAME = 'calibration.json'
+
+# fills the gaps of interleave()
+_MISSING = object()
+
+class Flight(object):
+    ''' The raw images below input_dir of a flight, converted to reflectance images below
+    output_dir with the radiance to reflectance factors of a calibration JSON file, or of
+    the calibration panel images (files or directories) panels given the {band name:
+    reflectance} panel_reflectance of the panel and an optional {filename: corners}
+    panel_corners of panels located by hand '''
+    def __init__(self, name, input_dir, output_dir, panels=(), panel_reflectance=None,
+                 panel_corners=None, calibration=None):
+        if calibration is None and not (panels and panel_reflectance):
+            raise ValueError("Flight {} needs a calibration file, or panel images and "
+                             "the reflectance of the panel".format(name))
+        self.name = name
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.panels = list(panels)
+        self.panel_reflectance = panel_reflectance
+        self.panel_corners = panel_corners
+        self.calibration = calibration
+
+    def __repr__(self):
+        return 'Flight({!r}, {!r}, {!r})'.format(self.name, self.input_dir, self.output_dir)
+
+def _check_names(flights):
+    names = [flight.name for flight in flights]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError("Flight names are not unique: {}".format(', '.join(duplicates)))
+
+def load_flights(path, panel_reflectance=None):
+    ''' The Flights of a JSON list of flights (see the module documentation); flights
+    without a "panel" use the {band name: reflectance} panel_reflectance '''
+    with open(path) as f:
+        specs = json.load(f)
+    flights = []
+    for spec in specs:
+        panel = spec.get('panel', panel_reflectance)
+        if isinstance(panel, str):
+            panel = calibration.load_panel_reflectance(panel)
+        name = spec.get('name') or os.path.basename(os.path.normpath(spec['input']))
+        flights.append(Flight(name, spec['input'], spec['output'], spec.get('panels', ()), panel,
+                              spec.get('panel_corners'), spec.get('calibration')))
+    _check_names(flights)
+    return flights
+
+def calibrate_flights(flights, workers=None):
+    ''' {flight name: {band name: radiance to reflectance factor}} of flights.  The
+    calibration file of a flight is read if it has one; the panel images of all other
+    flights are processed together on one pool of workers (one per image, up to one per
+    cpu, if None), and the factors of each written to CALIBRATION_NAME in its output
+    directory. '''
+    _check_names(flights)
+    calibrations = {}
+    tasks = []
+    owners = []
+    filenames = []
+    for flight in flights:
+        if flight.calibration is not None:
+            calibrations[flight.name] = batch.load_calibration(flight.calibration)
+            continue
+        panel_images = calibration.panel_images(flight.panels)
+        if not panel_images:
+            raise IOError("No calibration panel images for flight {}".format(flight.name))
+        corners = flight.panel_corners or {}
+        tasks += [(filename, flight.panel_reflectance, corners.get(filename)) for filename in panel_images]
+        owners += [flight.name] * len(panel_images)
+        filenames += panel_images
+    results = calibration.panel_factors(tasks, workers) if tasks else []
+    for flight in flights:
+        if flight.name in calibrations:
+            continue
+        mine = [i for i, owner in enumerate(owners) if owner == flight.name]
+        factors = calibration.average_factors([filenames[i] for i in mine], [results[i] for i in mine])
+        os.makedirs(flight.output_dir, exist_ok=True)
+        batch.save_calibration(factors, os.path.join(flight.output_dir, CALIBRATION_NAME))
+        calibrations[flight.name] = factors
+    return calibrations
+
+def interleave(sequences):
+    ''' The items of sequences, one of each in turn, until all are exhausted '''
+    items = []
+    for group in itertools.zip_longest(*sequences, fillvalue=_MISSING):
+        items += [item for item in group if item is not _MISSING]
+    return items
+
+def process_flights(flights, calibrations, workers=None, exiftoolPath=None, dtype=None,
+                    transfer_metadata=True, write_options=None, force=False, progress_callback=None,
+                    readers=pipeline.READERS, writers=pipeline.WRITERS, processes=True):
+    ''' Convert the raw images of every flight with its {band name: factor} in
+    calibrations, with the options of batch.process_directory(), on a single pipeline of
+    workers worker processes (or compute threads if not processes; one per cpu if None)
+    shared by all flights.  progress_callback
+    (if given) is called with the name of a flight and the fraction of its images done,
+    after each image.  Returns {flight name: (converted, skipped)}, as returned by
+    batch.process_directory() for each flight. '''
+    _check_names(flights)
+    conversions = []
+    succeeded = False
+    try:
+        for flight in flights:
+            conversions.append(batch.Conversion(flight.input_dir, flight.output_dir, calibrations[flight.name],
+                                                exiftoolPath, dtype, transfer_metadata, write_options,
+                                                force=force))
+        done = {flight.name: [] for flight in flights}
+        finished = {flight.name: 0 for flight in flights}
+        lock = threading.Lock()
+        if progress_callback is not None:
+            for flight, conversion in zip(flights, conversions):
+                if not conversion.jobs:
+                    progress_callback(flight.name, 1.0)
+
+        def read(item):
+            name, conversion, job = item
+            return conversion.read(job, processes)
+
+        def write(item, result):
+            name, conversion, job = item
+            converted = conversion.write(job, result)
+            with lock:
+                if converted is not None:
+                    done[name].append(converted)
+                finished[name] += 1
+                if progress_callback is not None:
+                    progress_callback(name, float(finished[name])/float(len(conversion.jobs)))
+            return converted
+
+        items = interleave([[(flight.name, conversion, job) for job in conversion.jobs]
+                            for flight, conversion in zip(flights, conversions)])
+        pipeline.Pipeline(read, batch.read_encode_task if processes else batch.encode_task, write,
+                          readers=readers, workers=workers, writers=writers, processes=processes,
+                          initializer=batch.initialize_worker, initargs=(exiftoolPath,)).run(items)
+        succeeded = True
+        return {flight.name: (done[flight.name], conversion.skipped)
+                for flight, conversion in zip(flights, conversions)}
+    finally:
+        errors = []
+        for conversion in conversions:
+            try:
+                conversion.close()
+            except Exception as e:
+                errors.append(e)
+        # an error of the pipeline takes precedence over one from closing a conversion
+        if errors and succeeded:
+            raise errors[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m micasense.scheduler',
+                                     description='Calibrate the panel images of several flights and convert '
+                                                 'their raw MicaSense images to reflectance images together.')
+    parser.add_argument('flights', help='JSON file of the list of flights')
+    parser.add_argument('-p', '--panel', default=None,
+                        help='JSON file of the reflectance of the calibration panel in each band name, '
+                             'for flights not giving their own')
+    batch.add_arguments(parser)
+    args = parser.parse_args(argv)
+    write_options = batch.parsed_write_options(parser, args)
+
+    panel_reflectance = calibration.load_panel_reflectance(args.panel) if args.panel else None
+    flights = load_flights(args.flights, panel_reflectance)
+    calibrations = calibrate_flights(flights, args.workers)
+    for flight in flights:
+        print('{}: {}'.format(flight.name, ', '.join('{} {:1.3f}'.format(band, factor)
+                                                     for band, factor in sorted(calibrations[flight.name].items()))))
+
+    fractions = {flight.name: 0.0 for flight in flights}
+    def progress(name, fraction):
+        fractions[name] = fraction
+        sys.stdout.write('\r' + '  '.join('{} {:5.1f}%'.format(flight.name, 100 * fractions[flight.name])
+                                           for flight in flights))
+        sys.stdout.flush()
+    done = process_flights(flights, calibrations, workers=args.workers, exiftoolPath=args.exiftool,
+                           dtype=args.dtype, transfer_metadata=not args.no_metadata,
+                           write_options=write_options, force=args.force,
+                           progress_callback=progress, processes=not args.threads)
+    print('')
+    for flight in flights:
+        converted, skipped = done[flight.name]
+        print('{}: converted {} images to reflectance'.format(flight.name, len(converted)))
+        batch.print_skipped(skipped)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+In-process RedEdge TIFF tag and XMP reader
+
+    Reads the TIFF IFD0, EXIF and GPS directories and the embedded XMP packet
+    of a RedEdge image directly, without starting exiftool.  Tags are returned
+    as a dictionary using the same "Group:TagName" keys and numeric value
+    conventions as `exiftool -G -n -j`, so the result can be used anywhere
+    the exif dictionary of a micasense.metadata.Metadata is expected.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import re
+import mmap
+import struct
+from contextlib import closing
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import cv2
+
+# TIFF field types: (struct format character, size in bytes)
+FIELD_TYPES = {
+    1: ('B', 1),   # BYTE
+    2: ('s', 1),   # ASCII
+    3: ('H', 2),   # SHORT
+    4: ('I', 4),   # LONG
+    5: ('II', 8),  # RATIONAL
+    6: ('b', 1),   # SBYTE
+    7: ('s', 1),   # UNDEFINED
+    8: ('h', 2),   # SSHORT
+    9: ('i', 4),   # SLONG
+    10: ('ii', 8), # SRATIONAL
+    11: ('f', 4),  # FLOAT
+    12: ('d', 8),  # DOUBLE
+    13: ('I', 4),  # IFD
+}
+
+# baseline tags describing the pixel data of an image
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+SAMPLE_FORMAT = 339
+
+EXIF_IFD_POINTER = 34665
+GPS_IFD_POINTER = 34853
+XMP_TAG = 700
+
+# tags of IFD0 and the EXIF sub-IFD, named as exiftool names them
+EXIF_TAGS = {
+    254: 'SubfileType',
+    256: 'ImageWidth',
+    257: 'ImageHeight',
+    258: 'BitsPerSample',
+    259: 'Compression',
+    262: 'PhotometricInterpretation',
+    270: 'ImageDescription',
+    271: 'Make',
+    272: 'Model',
+    273: 'StripOffsets',
+    274: 'Orientation',
+    277: 'SamplesPerPixel',
+    278: 'RowsPerStrip',
+    279: 'StripByteCounts',
+    282: 'XResolution',
+    283: 'YResolution',
+    284: 'PlanarConfiguration',
+    296: 'ResolutionUnit',
+    305: 'Software',
+    306: 'ModifyDate',
+    315: 'Artist',
+    317: 'Predictor',
+    322: 'TileWidth',
+    323: 'TileLength',
+    324: 'TileOffsets',
+    325: 'TileByteCounts',
+    339: 'SampleFormat',
+    33432: 'Copyright',
+    33434: 'ExposureTime',
+    33437: 'FNumber',
+    34850: 'ExposureProgram',
+    34855: 'ISO',
+    34864: 'SensitivityType',
+    34867: 'ISOSpeed',
+    36864: 'ExifVersion',
+    36867: 'DateTimeOriginal',
+    36868: 'CreateDate',
+    37377: 'ShutterSpeedValue',
+    37378: 'ApertureValue',
+    37383: 'MeteringMode',
+    37386: 'FocalLength',
+    37520: 'SubSecTime',
+    37521: 'SubSecTimeOriginal',
+    37522: 'SubSecTimeDigitized',
+    41486: 'FocalPlaneXResolution',
+    41487: 'FocalPlaneYResolution',
+    41488: 'FocalPlaneResolutionUnit',
+    42033: 'SerialNumber',
+    42034: 'LensInfo',
+    50706: 'DNGVersion',
+    50713: 'BlackLevelRepeatDim',
+    50714: 'BlackLevel',
+}
+
+GPS_TAGS = {
+    0: 'GPSVersionID',
+    1: 'GPSLatitudeRef',
+    2: 'GPSLatitude',
+    3: 'GPSLongitudeRef',
+    4: 'GPSLongitude',
+    5: 'GPSAltitudeRef',
+    6: 'GPSAltitude',
+    7: 'GPSTimeStamp',
+    9: 'GPSStatus',
+    10: 'GPSMeasureMode',
+    11: 'GPSDOP',
+    12: 'GPSSpeedRef',
+    13: 'GPSSpeed',
+    16: 'GPSImgDirectionRef',
+    17: 'GPSImgDirection',
+    18: 'GPSMapDatum',
+    29: 'GPSDateStamp',
+}
+
+# UNDEFINED-type tags which hold text rather than binary data
+TEXT_UNDEFINED_TAGS = ('ExifVersion',)
+
+# exiftool writes a JSON value unquoted (as a number) only if it matches this
+NUMBER = re.compile(r'^-?(\d|[1-9]\d{1,14})(\.\d{1,16})?(e[-+]?\d{1,3})?$', re.IGNORECASE)
+
+RDF_NS = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+XMPTK = '{adobe:ns:meta/}xmptk'
+
+def json_value(text):
+    ''' convert a value string as exiftool's JSON output would: numbers to int/float,
+    true/false to bool, others unchanged '''
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    if NUMBER.match(text):
+        if '.' in text or 'e' in text or 'E' in text:
+            return float(text)
+        return int(text)
+    return text
+
+def format_number(value):
+    ''' format a floating point number the way perl (and so exiftool) prints it '''
+    return '{:.15g}'.format(value)
+
+class TiffReader(object):
+    ''' Parses the tags of a TIFF file from a buffer (bytes or mmap) '''
+    def __init__(self, buf):
+        self.buf = buf
+        byte_order = buf[0:2]
+        if byte_order == b'II':
+            self.endian = '<'
+        elif byte_order == b'MM':
+            self.endian = '>'
+        else:
+            raise IOError("Not a TIFF file")
+        magic, self.ifd0_offset = self.unpack('HI', 2)
+        if magic != 42:
+            raise IOError("Not a TIFF file (BigTIFF is not supported)")
+        self.__ifd0 = None
+
+    def unpack(self, fmt, offset):
+        fmt = self.endian + fmt
+        return struct.unpack(fmt, self.buf[offset:offset+struct.calcsize(fmt)])
+
+    def read_ifd(self, offset):
+        ''' return a {tag: (type, count, values)} dictionary of the IFD at offset '''
+        entries = {}
+        num_entries, = self.unpack('H', offset)
+        for i in range(num_entries):
+            entry = offset + 2 + 12*i
+            tag, field_type, count = self.unpack('HHI', entry)
+            if field_type not in FIELD_TYPES:
+                continue
+            fmt, size = FIELD_TYPES[field_type]
+            value_offset = entry + 8
+            if size * count > 4:
+                value_offset, = self.unpack('I', value_offset)
+            if fmt == 's':
+                values = bytes(self.buf[value_offset:value_offset+count])
+            else:
+                values = self.unpack('{}{}'.format(count * len(fmt), fmt[0]), value_offset)
+                if len(fmt) == 2:
+                    # rationals are (numerator, denominator) pairs
+                    values = [float(n)/d if d != 0 else 0.0 for n, d in zip(values[0::2], values[1::2])]
+            entries[tag] = (field_type, count, values)
+        return entries
+
+    def ifd0(self):
+        if self.__ifd0 is None:
+            self.__ifd0 = self.read_ifd(self.ifd0_offset)
+        return self.__ifd0
+
+def tag_value(name, field_type, values):
+    ''' convert raw tag values to the exiftool -n representation, or None to skip the tag '''
+    if field_type in (2, 7):
+        if field_type == 7 and name not in TEXT_UNDEFINED_TAGS:
+            return None
+        text = values.split(b'\x00')[0].decode('utf-8', 'replace').strip()
+        return json_value(text)
+    if name in ('GPSLatitude', 'GPSLongitude'):
+        degrees = 0.0
+        for i, val in enumerate(values):
+            degrees += val / 60.0**i
+        return json_value(format_number(degrees))
+    if name == 'GPSVersionID':
+        return '.'.join(str(val) for val in values)
+    if name == 'GPSTimeStamp':
+        return ':'.join(format_number(val) for val in values)
+    if field_type in (5, 10, 11, 12):
+        strings = [format_number(val) for val in values]
+    else:
+        strings = [str(val) for val in values]
+    if len(strings) == 1:
+        return json_value(strings[0])
+    return ' '.join(strings)
+
+def add_ifd_tags(exif, entries, names, group='EXIF'):
+    for tag, (field_type, count, values) in sorted(entries.items()):
+        name = names.get(tag)
+        if name is None:
+            continue
+        value = tag_value(name, field_type, values)
+        if value is not None:
+            exif.setdefault('{}:{}'.format(group, name), value)
+
+def local_name(tag):
+    return tag.split('}')[-1]
+
+def xmp_value(element):
+    ''' value of an XMP property element: a list for rdf containers, a string otherwise '''
+    for container in ('Seq', 'Bag', 'Alt'):
+        items = element.find(RDF_NS + container)
+        if items is not None:
+            values = [json_value((li.text or '').strip()) for li in items.findall(RDF_NS + 'li')]
+            if container == 'Alt':
+                return values[0] if values else None
+            return values
+    return json_value((element.text or '').strip())
+
+def add_xmp_properties(exif, description, prefix=''):
+    for attr, text in description.attrib.items():
+        if attr.startswith(RDF_NS) or attr == XMPTK:
+            continue
+        exif.setdefault('XMP:' + prefix + local_name(attr), json_value(text.strip()))
+    for element in description:
+        name = prefix + local_name(element.tag)
+        struct_desc = element.find(RDF_NS + 'Description')
+        if struct_desc is not None:
+            add_xmp_properties(exif, struct_desc, name)
+        elif element.get(RDF_NS + 'parseType') == 'Resource':
+            add_xmp_properties(exif, element, name)
+        else:
+            exif.setdefault('XMP:' + name, xmp_value(element))
+
+def parse_xmp(packet):
+    ''' Parse an XMP packet into a dictionary of XMP:TagName keys '''
+    exif = {}
+    start = packet.find(b'<x:xmpmeta')
+    end = packet.find(b'</x:xmpmeta>')
+    if start < 0 or end < 0:
+        return exif
+    root = ElementTree.fromstring(packet[start:end+len(b'</x:xmpmeta>')])
+    toolkit = root.get(XMPTK)
+    if toolkit is not None:
+        exif['XMP:XMPToolkit'] = toolkit
+    rdf = root.find(RDF_NS + 'RDF')
+    if rdf is None:
+        return exif
+    for description in rdf.findall(RDF_NS + 'Description'):
+        add_xmp_properties(exif, description)
+    return exif
+
+def read_metadata_buffer(buf, filename=None):
+    ''' Extract the tags of a TIFF image held in a buffer '''
+    return read_tags(TiffReader(buf), filename)
+
+def read_tags(reader, filename=None):
+    ''' Extract the tags of a TIFF image from its TiffReader '''
+    exif = {}
+    if filename is not None:
+        exif['SourceFile'] = filename
+    ifd0 = reader.ifd0()
+    add_ifd_tags(exif, ifd0, EXIF_TAGS)
+    if EXIF_IFD_POINTER in ifd0:
+        add_ifd_tags(exif, reader.read_ifd(ifd0[EXIF_IFD_POINTER][2][0]), EXIF_TAGS)
+    if GPS_IFD_POINTER in ifd0:
+        add_ifd_tags(exif, reader.read_ifd(ifd0[GPS_IFD_POINTER][2][0]), GPS_TAGS)
+    if XMP_TAG in ifd0:
+        packet = ifd0[XMP_TAG][2]
+        if not isinstance(packet, bytes):
+            packet = bytes(bytearray(packet))
+        exif.update(parse_xmp(packet))
+    return exif
+
+def read_metadata(filename):
+    ''' Extract the tags of a TIFF image file, in exiftool "-G -n" form.
+    The file is memory mapped, so only the pages holding the IFDs and XMP are read '''
+    if not os.path.isfile(filename):
+        raise IOError("Input path is not a file: {}".format(filename))
+    with open(filename, 'rb') as f:
+        with closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as buf:
+            return read_metadata_buffer(buf, filename)
+
+def read_metadata_batch(filenames):
+    return [read_metadata(filename) for filename in filenames]
+
+def raw_layout(reader):
+    ''' (offset, (height, width)) of the pixels of IFD0 if they are uncompressed,
+    little endian, single sample, unsigned 16 bit and stored as one contiguous run of
+    strips; otherwise None '''
+    ifd0 = reader.ifd0()
+    def value(tag, default=None):
+        return ifd0[tag][2][0] if tag in ifd0 else default
+    if reader.endian != '<' or value(COMPRESSION, 1) != 1 or value(SAMPLES_PER_PIXEL, 1) != 1 \
+            or value(BITS_PER_SAMPLE) != 16 or value(SAMPLE_FORMAT, 1) != 1 \
+            or STRIP_OFFSETS not in ifd0 or STRIP_BYTE_COUNTS not in ifd0:
+        return None
+    width, height = value(IMAGE_WIDTH), value(IMAGE_LENGTH)
+    offsets, byte_counts = ifd0[STRIP_OFFSETS][2], ifd0[STRIP_BYTE_COUNTS][2]
+    for i in range(1, len(offsets)):
+        if offsets[i] != offsets[i-1] + byte_counts[i-1]:
+            return None
+    if sum(byte_counts) != width * height * 2:
+        return None
+    return offsets[0], (height, width)
+
+def memmap_raw(filename, mode='r'):
+    ''' Map the raw pixels of a TIFF image as a (height, width) uint16 numpy.memmap,
+    without reading or copying them, or return None if the pixel data can't be mapped
+    (e.g. it is compressed) and must be decoded instead.  The map is read-only with
+    mode 'r', and copy-on-write with mode 'c': writes change the array, never the file. '''
+    with open(filename, 'rb') as f:
+        with closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as buf:
+            layout = raw_layout(TiffReader(buf))
+    if layout is None:
+        return None
+    offset, shape = layout
+    return np.memmap(filename, dtype='<u2', mode=mode, offset=offset, shape=shape)
+
+def read_image(filename):
+    ''' Read the tags and the raw pixels of a TIFF image, opening and parsing the file once.
+    Returns (exif, raw): exif as from read_metadata(), raw a writable (height, width)
+    array.  Uncompressed pixels are a view of a copy-on-write memory map of the file, so
+    they are only read from disk when used and writes never change the file; other pixel
+    data is decoded from the same map. '''
+    if not os.path.isfile(filename):
+        raise IOError("Input path is not a file: {}".format(filename))
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    reader = TiffReader(buf)
+    exif = read_tags(reader, filename)
+    layout = raw_layout(reader)
+    if layout is not None:
+        # the array keeps the map open for as long as it is used
+        offset, shape = layout
+        raw = np.frombuffer(buf, dtype='<u2', count=shape[0]*shape[1], offset=offset).reshape(shape)
+    else:
+        data = np.frombuffer(buf, dtype=np.uint8)
+        raw = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        del data
+        buf.close()
+        if raw is None:
+            raise IOError("Could not decode the pixels of {}".format(filename))
+    return exif, raw
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compressed and tiled TIFF writer for reflectance images
+
+    Writes single band uint16 or floating point images as little endian
+    TIFFs, in strips or tiles, compressed with DEFLATE (zlib), ZSTD or LZW and
+    an optional predictor (horizontal differencing for integers, the floating
+    point predictor for floats).  The strips or tiles are encoded in parallel
+    on a thread pool, as zlib releases the GIL while compressing.
+
+    DEFLATE is always available.  ZSTD uses the zstandard or imagecodecs
+    package and LZW the imagecodecs package, if installed; otherwise untiled
+    images are written with OpenCV (libtiff), single threaded.
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+import micasense.radiometry as radiometry
+
+# TIFF compression codes
+COMPRESSIONS = {'none': 1, 'lzw': 5, 'deflate': 8, 'zstd': 50000}
+PREDICTOR_NONE = 1
+PREDICTOR_HORIZONTAL = 2
+PREDICTOR_FLOATINGPOINT = 3
+# compression level used if none is given; higher DEFLATE levels are much slower,
+# and barely smaller on reflectance images
+DEFAULT_LEVELS = {'deflate': 1, 'zstd': 3}
+# rows per strip of untiled images, small enough to spread a frame over the threads
+ROWS_PER_STRIP = 64
+
+# TIFF tags
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP_TAG = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+SHORT = 3
+LONG = 4
+
+def encoder(compression, level=None):
+    ''' A function compressing a bytes-like segment for compression (one of COMPRESSIONS),
+    or None if no package to compress with it is installed '''
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression {}, use one of {}".format(compression, sorted(COMPRESSIONS)))
+    if level is None:
+        level = DEFAULT_LEVELS.get(compression)
+    if compression == 'none':
+        return bytes
+    if compression == 'deflate':
+        return lambda data: zlib.compress(data, level)
+    if compression == 'zstd':
+        try:
+            import zstandard
+            return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+        except ImportError:
+            pass
+    try:
+        import imagecodecs
+    except ImportError:
+        return None
+    if compression == 'zstd':
+        return lambda data: imagecodecs.zstd_encode(data, level=level)
+    return imagecodecs.lzw_encode
+
+def available(compression, tile=None):
+    ''' Whether images can be written with compression (one of COMPRESSIONS), in tiles if
+    tile, with the installed packages.  Without an encoder package this depends on the
+    codecs the libtiff of OpenCV was built with, so a tiny image is encoded to find out. '''
+    if encoder(compression) is not None:
+        return True
+    if tile is not None:
+        return False
+    try:
+        encode_tiff_cv2(np.zeros((16, 16), dtype=np.uint16), compression, PREDICTOR_NONE)
+    except IOError:
+        return False
+    return True
+
+def apply_predictor(segment, predictor):
+    ''' The bytes of a 2D segment with a TIFF predictor applied to each row '''
+    if predictor == PREDICTOR_HORIZONTAL:
+        encoded = segment.copy()
+        encoded[:, 1:] -= segment[:, :-1]
+        return encoded
+    if predictor == PREDICTOR_FLOATINGPOINT:
+        # the bytes of the samples of each row, most significant bytes first, differenced
+        height, width = segment.shape
+        size = segment.dtype.itemsize
+        planes = segment.astype(segment.dtype.newbyteorder('>')).view(np.uint8)
+        planes = planes.reshape(height, width, size).transpose(0, 2, 1).reshape(height, width * size)
+        encoded = planes.copy()
+        encoded[:, 1:] -= planes[:, :-1]
+        return encoded
+    return segment
+
+def segments(image, tile=None, rows_per_strip=ROWS_PER_STRIP):
+    ''' The strips of image, or its tile x tile tiles (edge tiles zero padded), in TIFF order '''
+    height, width = image.shape
+    if tile is None:
+        return [image[row:row+rows_per_strip] for row in range(0, height, rows_per_strip)]
+    tiles = []
+    for row in range(0, height, tile):
+        for column in range(0, width, tile):
+            block = image[row:row+tile, column:column+tile]
+            if block.shape != (tile, tile):
+                padded = np.zeros((tile, tile), dtype=image.dtype)
+                padded[:block.shape[0], :block.shape[1]] = block
+                block = padded
+            tiles.append(block)
+    return tiles
+
+def ifd_entry(tag, field_type, values):
+    ''' (tag, type, count, packed values) of an IFD entry '''
+    fmt = 'H' if field_type == SHORT else 'I'
+    return tag, field_type, len(values), struct.pack('<{}{}'.format(len(values), fmt), *values)
+
+def write_tiff(filename, image, **options):
+    ''' Write a 2D uint16 or floating point image as a TIFF, with the encode_tiff() options '''
+    data = encode_tiff(image, **options)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def encode_tiff(image, compression='deflate', predictor=True, tile=None, level=None,
+                threads=None, rows_per_strip=ROWS_PER_STRIP):
+    ''' The bytes of a TIFF of a 2D uint16 or floating point image, compressed with compression
+    (one of COMPRESSIONS) at level (DEFAULT_LEVELS if None), with the predictor suited to its
+    dtype if predictor, in tile x tile tiles (a multiple of 16) if tile, otherwise in strips
+    of rows_per_strip rows.  threads strips or tiles are encoded at a time (one per cpu if None). '''
+    image = np.asarray(image)
+    if image.ndim != 2 or image.dtype not in (np.uint16, np.float32, np.float64):
+        raise ValueError("Only 2D uint16, float32 or float64 images can be written, not {} {}".format(
+                         image.ndim, image.dtype))
+    if tile is not None and (tile <= 0 or tile % 16 != 0):
+        raise ValueError("Tile size {} is not a positive multiple of 16".format(tile))
+    if compression == 'none':
+        predictor = False
+    predictor = (PREDICTOR_FLOATINGPOINT if image.dtype.kind == 'f' else PREDICTOR_HORIZONTAL) \
+        if predictor else PREDICTOR_NONE
+    encode = encoder(compression, level)
+    if encode is None:
+        return encode_tiff_cv2(image, compression, predictor, tile)
+    image = image.astype(image.dtype.newbyteorder('<'), copy=False)
+
+    def encode_segment(segment):
+        return encode(np.ascontiguousarray(apply_predictor(segment, predictor)))
+    blocks = segments(image, tile, rows_per_strip)
+    if threads == 1 or len(blocks) == 1:
+        encoded = [encode_segment(block) for block in blocks]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            encoded = list(executor.map(encode_segment, blocks))
+
+    height, width = image.shape
+    offsets = []
+    offset = 8
+    for data in encoded:
+        offsets.append(offset)
+        offset += len(data)
+    ifd_offset = offset + (offset % 2)
+    entries = [ifd_entry(NEW_SUBFILE_TYPE, LONG, [0]),
+               ifd_entry(IMAGE_WIDTH, LONG, [width]),
+               ifd_entry(IMAGE_LENGTH, LONG, [height]),
+               ifd_entry(BITS_PER_SAMPLE, SHORT, [8 * image.dtype.itemsize]),
+               ifd_entry(COMPRESSION, SHORT, [COMPRESSIONS[compression]]),
+               ifd_entry(PHOTOMETRIC, SHORT, [1]), # min-is-black
+               ifd_entry(SAMPLES_PER_PIXEL, SHORT, [1]),
+               ifd_entry(PLANAR_CONFIGURATION, SHORT, [1]),
+               ifd_entry(PREDICTOR, SHORT, [predictor]),
+               ifd_entry(SAMPLE_FORMAT, SHORT, [3 if image.dtype.kind == 'f' else 1])]
+    if tile is None:
+        entries += [ifd_entry(STRIP_OFFSETS, LONG, offsets),
+                    ifd_entry(ROWS_PER_STRIP_TAG, LONG, [rows_per_strip]),
+                    ifd_entry(STRIP_BYTE_COUNTS, LONG, [len(data) for data in encoded])]
+    else:
+        entries += [ifd_entry(TILE_WIDTH, LONG, [tile]),
+                    ifd_entry(TILE_LENGTH, LONG, [tile]),
+                    ifd_entry(TILE_OFFSETS, LONG, offsets),
+                    ifd_entry(TILE_BYTE_COUNTS, LONG, [len(data) for data in encoded])]
+    entries.sort()
+    # values longer than 4 bytes follow the IFD
+    values_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd = [struct.pack('<H', len(entries))]
+    values = []
+    for tag, field_type, count, packed in entries:
+        if len(packed) <= 4:
+            ifd.append(struct.pack('<HHI', tag, field_type, count) + packed.ljust(4, b'\0'))
+        else:
+            ifd.append(struct.pack('<HHII', tag, field_type, count, values_offset))
+            values.append(packed)
+            values_offset += len(packed)
+    ifd.append(struct.pack('<I', 0))
+
+    return b''.join([struct.pack('<2sHI', b'II', 42, ifd_offset)] + encoded +
+                    [b'\0' * (ifd_offset - offset)] + ifd + values)
+
+def encode_tiff_cv2(image, compression, predictor, tile=None):
+    ''' The bytes of an untiled TIFF encoded by OpenCV, for compressions without an installed encoder '''
+    if tile is not None:
+        raise ValueError("Writing tiled {} TIFFs requires the imagecodecs package".format(compression))
+    params = [cv2.IMWRITE_TIFF_COMPRESSION, COMPRESSIONS[compression],
+              cv2.IMWRITE_TIFF_PREDICTOR, predictor]
+    ok, data = cv2.imencode('.tif', image, params)
+    if not ok:
+        raise IOError("Could not encode a {} compressed image".format(compression))
+    return data.tobytes()
+
+def write_reflectance(filename, reflectance, dtype=None, **options):
+    ''' Write a reflectance image in the pixel dtype, with the encode_tiff() options '''
+    data = encode_reflectance(reflectance, dtype, **options)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def encode_reflectance(reflectance, dtype=None, **options):
+    ''' The TIFF bytes of a reflectance image in the pixel dtype (see micasense.radiometry;
+    uint16 stores reflectance * UINT16_REFLECTANCE_SCALE), with the encode_tiff() options.
+    Half floats are written as float32, which more TIFF readers support. '''
+    reflectance = radiometry.convert(reflectance, dtype, reflectance=True)
+    if reflectance.dtype == np.float16:
+        reflectance = reflectance.astype(np.float32)
+    return encode_tiff(reflectance, **options)
@@ -25,13 +25,12 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import cv2
 import numpy as np
+import micasense.radiometry as radiometry
+import micasense.imageutils as imageutils
 
-def raw_image_to_radiance(meta, imageRaw):
-    # get image dimensions
-    imageRaw = imageRaw.T
-    xDim = imageRaw.shape[0]
-    yDim = imageRaw.shape[1]
-
+def radiometric_corrections(meta, xDim, yDim, dtype=None):
+    ''' (dark level, vignette map, row gradient, radiance scale) of an image,
+    the inputs of radiometry.calibrate(), with the maps in the compute type of dtype '''
     #  get radiometric calibration factors
 
     # radiometric sensitivity
@@ -50,36 +49,53 @@ def raw_image_to_radiance(meta, imageRaw):
     exposureTime = float(meta.get_item('EXIF:ExposureTime'))
     gain = float(meta.get_item('EXIF:ISOSpeed'))/100.0 
 
+    # compute the vignette map image, shared by every image of this band
+    V = vignette_map(meta, xDim, yDim, dtype)[0].T
 
-    # apply image correction methods to raw image
-    # step 1 - row gradient correction, vignette & radiometric calibration:
-    # compute the vignette map image
-    V, x, y = vignette_map(meta, xDim, yDim)
-
-    # row gradient correction
-    R = 1.0 / (1.0 + a2 * y / exposureTime - a3 * y)
-
-    # subtract the dark level and adjust for vignette and row gradient
-    L = V * R * (imageRaw - darkLevel)
-
-    # Floor any negative radiances to zero (can happend due to noise around blackLevel)
-    L[L < 0] = 0
-
-    #L = np.round(L).astype(np.uint16)
+    # row gradient correction, shared by every image with this exposure
+    R = radiometry.row_gradient((a1, a2, a3), exposureTime, yDim, dtype)
 
-    # apply the radiometric calibration - i.e. scale by the gain-exposure product and
+    # the radiometric calibration - i.e. scale by the gain-exposure product and
     # multiply with the radiometric calibration coefficient
     # need to normalize by 2^16 for 16 bit images
     # because coefficients are scaled to work with input values of max 1.0
     bitsPerPixel = meta.get_item('EXIF:BitsPerSample')
-    bitDepthMax = float(2**bitsPerPixel)
-    radianceImage = L.astype(float)/(gain * exposureTime)*a1/bitDepthMax
+    radianceScale, _ = radiometry.scale_factors((a1, a2, a3), gain, exposureTime, bitsPerPixel)
+    return darkLevel, V, R, radianceScale
+
+def raw_image_to_radiance(meta, imageRaw, dtype=None):
+    # dtype overrides the pixel dtype policy of micasense.radiometry
+    # get image dimensions
+    yDim, xDim = imageRaw.shape
+
+    # apply image correction methods to raw image
+    # step 1 - row gradient correction, vignette & radiometric calibration:
+    darkLevel, V, R, radianceScale = radiometric_corrections(meta, xDim, yDim, dtype)
+
+    # subtract the dark level and adjust for vignette and row gradient, and
+    # floor any negative radiances to zero (can happend due to noise around blackLevel)
+    L = radiometry.calibrate(imageRaw, darkLevel, V, R, dtype=radiometry.compute_dtype(dtype))
+
+    # apply the radiometric calibration
+    radianceImage = radiometry.convert(L * L.dtype.type(radianceScale), dtype)
     
     # return both the radiance compensated image and the DN corrected image, for the
     # sake of the tutorial and visualization
-    return radianceImage.T, L.T, V.T, R.T
-
-def vignette_map(meta, xDim, yDim):
+    return radianceImage, L, V, np.broadcast_to(R, (yDim, xDim))
+
+def raw_image_to_reflectance(meta, imageRaw, radianceToReflectance, dtype=None):
+    # the reflectance image of a raw image, given the radiance to reflectance factor
+    # of its band (from a panel, or pi / irradiance).  The factor is folded into the
+    # radiometric calibration, so the image is written once and no radiance image is kept.
+    # dtype overrides the pixel dtype policy of micasense.radiometry
+    yDim, xDim = imageRaw.shape
+    darkLevel, V, R, radianceScale = radiometric_corrections(meta, xDim, yDim, dtype)
+    reflectanceImage = radiometry.calibrate(imageRaw, darkLevel, V, R, radianceScale * radianceToReflectance,
+                                            dtype=radiometry.compute_dtype(dtype))
+    return radiometry.convert(reflectanceImage, dtype, reflectance=True)
+
+def vignette_map(meta, xDim, yDim, dtype=None):
+    # dtype overrides the pixel dtype policy of micasense.radiometry
     # get vignette center
     xVignette = float(meta.get_item('XMP:VignettingCenter', 0))
     yVignette = float(meta.get_item('XMP:VignettingCenter', 1))
@@ -88,25 +104,12 @@ def vignette_map(meta, xDim, yDim):
     NvignettePoly = meta.size('XMP:VignettingPolynomial')
     vignettePolyList = [float(meta.get_item('XMP:VignettingPolynomial', i)) for i in range(NvignettePoly)]
 
-    # reverse list and append 1., so that we can call with numpy polyval
-    vignettePolyList.reverse()
-    vignettePolyList.append(1.)
-    vignettePoly = np.array(vignettePolyList)
-
-    # perform vignette correction
-    # get coordinate grid across image
-    x, y = np.meshgrid(np.arange(xDim), np.arange(yDim))
-
-    #meshgrid returns transposed arrays
-    x = x.T
-    y = y.T
-
-    # compute matrix of distances from image center
-    r = np.hypot((x-xVignette), (y-yVignette))
+    # the vignette map of a band is computed once and shared, in image orientation
+    vignette = radiometry.vignette_map((xVignette, yVignette), vignettePolyList, xDim, yDim, dtype).T
 
-    # compute the vignette polynomial for each distance - we divide by the polynomial so that the
-    # corrected image is image_corrected = image_original * vignetteCorrection
-    vignette = 1./np.polyval(vignettePoly, r)
+    # coordinate grids, transposed like the vignette map
+    x = np.broadcast_to(np.arange(xDim)[:, np.newaxis], (xDim, yDim))
+    y = np.broadcast_to(np.arange(yDim), (xDim, yDim))
     return vignette, x, y
 
 def correct_lens_distortion(meta, image):
@@ -114,7 +117,7 @@ def correct_lens_distortion(meta, image):
     Ndistortion = meta.size('XMP:PerspectiveDistortion')
     distortionParameters = np.array([float(meta.get_item('XMP:PerspectiveDistortion', i)) for i in range(Ndistortion)])
     #get the two principal points
-    pp = np.array(meta.get_item('XMP:PrincipalPoint').split(',')).astype(np.float)
+    pp = np.array(meta.get_item('XMP:PrincipalPoint').split(',')).astype(float)
     # values in pp are in [mm] and need to be rescaled to pixels
     FocalPlaneXResolution = float(meta.get_item('EXIF:FocalPlaneXResolution'))
     FocalPlaneYResolution = float(meta.get_item('EXIF:FocalPlaneYResolution'))
@@ -140,13 +143,8 @@ def correct_lens_distortion(meta, image):
     #dist_coeffs = np.array(k[0],k[1],p[0],p[1],k[2]])
     dist_coeffs = distortionParameters[[0, 1, 3, 4, 2]]
     
-    new_cam_mat, _ = cv2.getOptimalNewCameraMatrix(cam_mat, dist_coeffs, (w, h), 1)
-    map1, map2 = cv2.initUndistortRectifyMap(cam_mat,
-                                             dist_coeffs,
-                                             np.eye(3),
-                                             new_cam_mat,
-                                             (w, h),
-                                             cv2.CV_32F) # cv2.CV_32F for 32 bit floats
+    # the maps are shared by every image with these lens parameters
+    map1, map2 = imageutils.undistortion_maps(cam_mat, dist_coeffs, (w, h))
     # compute the undistorted 16 bit image
     undistortedImage = cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
     return undistortedImage
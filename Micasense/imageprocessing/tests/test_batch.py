@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test batch conversion
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import pytest
+import os
+import argparse
+import cv2
+import numpy as np
+
+import micasense.batch as batch
+import micasense.image as image
+import micasense.metadata as metadata
+import micasense.tiffwriter as tiffwriter
+import micasense.utils as msutils
+
+calibration = {'Blue': 0.5, 'Green': 0.6, 'Red': 0.7, 'NIR': 0.8, 'Red edge': 0.9}
+
+def test_calibration_file(tmpdir):
+    path = os.path.join(str(tmpdir), 'calibration.json')
+    batch.save_calibration(calibration, path)
+    assert batch.load_calibration(path) == calibration
+
+def test_find_images(tmpdir):
+    jobs = batch.find_images(os.path.join('data', '0000SET'), str(tmpdir))
+    assert len(jobs) == 10
+    assert jobs[0] == (os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif'),
+                       os.path.join(str(tmpdir), '000', 'IMG_0000_1.tif'))
+
+def test_unavailable_compression(monkeypatch):
+    parser = argparse.ArgumentParser()
+    batch.add_arguments(parser)
+    monkeypatch.setattr(tiffwriter, 'available', lambda compression, tile=None: compression != 'zstd')
+    args = parser.parse_args(['--compression', 'zstd'])
+    with pytest.raises(SystemExit):
+        batch.parsed_write_options(parser, args)
+    args = parser.parse_args(['--compression', 'deflate', '--tile', '64'])
+    assert batch.parsed_write_options(parser, args)['tile'] == 64
+
+@pytest.mark.parametrize('processes', [True, False])
+def test_process_directory(tmpdir, processes):
+    done, skipped = batch.process_directory(os.path.join('data', '0000SET'), str(tmpdir), calibration,
+                                            workers=2, transfer_metadata=False, processes=processes)
+    assert len(done) == 10
+    assert skipped == []
+    source, output = sorted(done)[3]
+    meta = metadata.Metadata(source)
+    expected = msutils.raw_image_to_reflectance(meta, cv2.imread(source, cv2.IMREAD_UNCHANGED),
+                                                calibration[meta.band_name()])
+    reflectance = cv2.imread(output, cv2.IMREAD_UNCHANGED)
+    assert reflectance.dtype == np.float32
+    assert np.allclose(reflectance, expected)
+
+def test_missing_band(tmpdir):
+    # the images of bands without a factor are skipped instead of failing the run
+    done, skipped = batch.process_directory(os.path.join('data', '0000SET'), str(tmpdir), {'Blue': 0.5},
+                                            workers=1, transfer_metadata=False)
+    assert sorted(os.path.basename(output) for source, output in done) == ['IMG_0000_1.tif', 'IMG_0001_1.tif']
+    assert len(skipped) == 8
+    assert set(band for source, band in skipped) == {'Green', 'Red', 'NIR', 'Red edge'}
+    assert not os.path.exists(os.path.join(str(tmpdir), '000', 'IMG_0000_2.tif'))
+    with pytest.raises(ValueError):
+        batch.convert_image(image.Image.load(os.path.join('data', '0000SET', '000', 'IMG_0000_2.tif')),
+                            os.path.join(str(tmpdir), 'green.tif'), {'Blue': 0.5})
+
+def test_resume(tmpdir):
+    input_dir = os.path.join('data', '0000SET')
+    done, skipped = batch.process_directory(input_dir, str(tmpdir), calibration, workers=1,
+                                            transfer_metadata=False)
+    assert len(done) == 10
+    assert os.path.isfile(os.path.join(str(tmpdir), batch.MANIFEST_NAME))
+    assert batch.process_directory(input_dir, str(tmpdir), calibration, workers=1,
+                                   transfer_metadata=False) == ([], [])
+    # only the images of the recalibrated band, and a deleted output, are converted again
+    os.remove(os.path.join(str(tmpdir), '000', 'IMG_0000_1.tif'))
+    done, skipped = batch.process_directory(input_dir, str(tmpdir), dict(calibration, Green=0.65),
+                                            workers=1, transfer_metadata=False)
+    assert sorted(os.path.basename(output) for source, output in done) == \
+        ['IMG_0000_1.tif', 'IMG_0000_2.tif', 'IMG_0001_2.tif']
+    done, skipped = batch.process_directory(input_dir, str(tmpdir), dict(calibration, Green=0.65),
+                                            workers=1, transfer_metadata=False, force=True)
+    assert len(done) == 10
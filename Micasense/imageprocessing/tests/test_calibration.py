@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test panel calibration
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import pytest
+import os
+
+import micasense.calibration as calibration
+
+@pytest.fixture()
+def panel_image_name():
+    return os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif')
+
+panel_corners = [[809, 613], [648, 615], [646, 454], [808, 452]]
+
+def test_panel_images():
+    filenames = calibration.panel_images([os.path.join('data', '0000SET'),
+                                          os.path.join('data', '0001SET', '000', 'IMG_0002_4.tif')])
+    assert len(filenames) == 11
+    assert filenames[0] == os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif')
+
+def test_panel_factor(panel_image_name):
+    band, factor = calibration.panel_factor(panel_image_name, {'Blue': 0.67}, panel_corners)
+    assert band == 'Blue'
+    assert factor == pytest.approx(0.67 / 0.170284, rel=0.01)
+
+def test_panel_not_detected():
+    flight_image_name = os.path.join('data', '0000SET', '000', 'IMG_0001_1.tif')
+    with pytest.raises(IOError):
+        calibration.panel_factor(flight_image_name, {'Blue': 0.67})
+
+def test_calibrate_panels(panel_image_name):
+    factors = calibration.calibrate_panels([panel_image_name, panel_image_name], {'Blue': 0.67},
+                                           panel_corners={panel_image_name: panel_corners}, workers=2)
+    assert list(factors) == ['Blue']
+    assert factors['Blue'] == pytest.approx(0.67 / 0.170284, rel=0.01)
+
+def test_calibrate_panels_skips_undetected(panel_image_name):
+    flight_image_name = os.path.join('data', '0000SET', '000', 'IMG_0001_1.tif')
+    factors = calibration.calibrate_panels([panel_image_name, flight_image_name], {'Blue': 0.67},
+                                           panel_corners={panel_image_name: panel_corners}, workers=1)
+    assert factors['Blue'] == pytest.approx(0.67 / 0.170284, rel=0.01)
+    # a band whose panel is not detected in any image has no factor
+    with pytest.raises(IOError):
+        calibration.calibrate_panels([flight_image_name], {'Blue': 0.67}, workers=1)
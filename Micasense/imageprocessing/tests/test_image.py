@@ -30,6 +30,7 @@ import numpy as np
 
 import micasense.image as image
 import micasense.panel as panel
+import micasense.utils as msutils
 
 @pytest.fixture()
 def img():
@@ -59,9 +60,24 @@ def test_equal(img,img2):
 def test_not_equal(img,img2):
     assert img != img2
 
+def test_lazy_metadata(img):
+    assert not hasattr(img, '__dict__')
+    assert not hasattr(img, '_utc_time')
+    assert img.utc_time.isoformat() == '2017-10-19T20:40:39.200174+00:00'
+    assert hasattr(img, '_utc_time')
+    assert img.band_name == 'Blue'
+
 def test_load_image_raw(img):
     assert img.raw() is not None
 
+def test_raw_writable(img):
+    raw = img.raw()
+    value = int(raw[0, 0])
+    raw[0, 0] = value + 1
+    assert img.raw()[0, 0] == value + 1
+    # the raw image is copy-on-write, so the file is unchanged
+    assert image.Image(img.path).raw()[0, 0] == value
+
 def test_clear_image_data(img):
     assert img.undistorted(img.radiance()) is not None
     img.clear_image_data()
@@ -94,3 +110,71 @@ def test_cv2_camera_matrix(img):
                 [   0.0,    0.0,   1.0]]
     for idx, row in enumerate(img.cv2_camera_matrix()):
         assert row == pytest.approx(test_mat[idx], abs=0.1)
+
+def test_radiance_dtype(img):
+    radiance = img.radiance()
+    assert radiance.dtype == np.float32
+    radiance64 = img.radiance(dtype='float64')
+    assert radiance64.dtype == np.float64
+    assert np.allclose(radiance64, radiance, rtol=1e-5)
+    reflectance = img.reflectance(1.0, dtype='uint16')
+    assert reflectance.dtype == np.uint16
+    assert img.radiance().dtype == np.float32
+
+def test_reflectance_float64(img):
+    irradiance = 0.5
+    reflectance = img.reflectance(irradiance, dtype='float64')
+    assert reflectance.dtype == np.float64
+    # the formula of utils.raw_image_to_radiance() before the shared maps, all in float64
+    raw = img.raw().astype(np.float64)
+    height, width = raw.shape
+    x, y = np.meshgrid(np.arange(width), np.arange(height))
+    polynomial = list(reversed(img.vignette_polynomial)) + [1.]
+    V = 1. / np.polyval(polynomial, np.hypot(x - img.vignette_center[0], y - img.vignette_center[1]))
+    a1, a2, a3 = img.radiometric_cal
+    R = 1.0 / (1.0 + a2 * y / img.exposure_time - a3 * y)
+    L = V * R * (raw - img.black_level)
+    L[L < 0] = 0
+    radiance = L / (img.gain * img.exposure_time) * a1 / float(2**img.bits_per_pixel)
+    expected = radiance * math.pi / irradiance
+    assert np.allclose(reflectance, expected, rtol=1e-12, atol=0)
+    assert np.allclose(msutils.raw_image_to_reflectance(img.meta, img.raw(), math.pi / irradiance, dtype='float64'),
+                       expected, rtol=1e-12, atol=0)
+
+def test_undistorted_per_stage(img):
+    undistorted_raw = img.undistorted(img.raw())
+    undistorted_radiance = img.undistorted(img.radiance())
+    assert img.undistorted(img.raw()) is undistorted_raw
+    assert img.undistorted(img.radiance()) is undistorted_radiance
+    # a new stage image invalidates its undistorted image
+    img.radiance(force_recompute=True)
+    assert img.undistorted(img.radiance()) is not undistorted_radiance
+    assert img.undistorted(img.raw()) is undistorted_raw
+
+def test_stream(img):
+    radiance = img.radiance()
+    out = np.empty_like(radiance)
+    assert img.stream('radiance', out=out, block_rows=100) is out
+    assert np.allclose(out, radiance, rtol=1e-6)
+    reflectance = img.stream('reflectance', irradiance=1.0)
+    assert np.allclose(reflectance, img.reflectance(1.0), rtol=1e-6)
+    with pytest.raises(RuntimeError):
+        img.stream('reflectance')
+    with pytest.raises(ValueError):
+        img.stream('radiance', out=np.empty(radiance.shape, dtype=np.uint16))
+
+def test_reflectance_without_radiance(img):
+    img.clear_image_data()
+    reflectance = img.reflectance(2.0)
+    assert img._Image__radiance_image is None
+    assert np.allclose(reflectance, img.radiance() * (math.pi / 2.0), rtol=1e-6)
+
+def test_load(img):
+    loaded = image.Image.load(img.path)
+    assert loaded.band_name == img.band_name
+    assert loaded.meta.get_item('XMP:CaptureId') == img.meta.get_item('XMP:CaptureId')
+    assert np.array_equal(loaded.raw(), img.raw())
+    assert np.allclose(loaded.radiance(), img.radiance())
+    # the raw image is copy-on-write, so the file is unchanged
+    loaded.raw()[0, 0] += 1
+    assert image.Image.load(img.path).raw()[0, 0] == img.raw()[0, 0]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test image data cache
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import os
+import gc
+
+import micasense.image as image
+import micasense.imagecache as imagecache
+
+@pytest.fixture()
+def images():
+    image_path = os.path.join('data', '0000SET', '000')
+    return [image.Image(os.path.join(image_path, 'IMG_0000_{}.tif'.format(band))) for band in range(1, 6)]
+
+@pytest.fixture()
+def small_cache():
+    imagecache.set_cache_size(8 * 1024 * 1024)
+    yield imagecache.get_cache()
+    imagecache.set_cache_size(imagecache.CACHE_BYTES)
+
+def test_evicts_least_recently_used(images, small_cache):
+    for img in images:
+        img.radiance()
+    assert small_cache.nbytes <= small_cache.max_bytes
+    # the oldest radiance images were released and are recomputed on demand
+    assert images[0]._Image__radiance_image is None
+    assert images[-1]._Image__radiance_image is not None
+    assert images[0].radiance() is not None
+
+def test_undistorted_evicted_with_source(images, small_cache):
+    img = images[0]
+    img.undistorted(img.radiance())
+    img.clear_image_data(names=['radiance_image'])
+    assert img._Image__undistorted_image is None
+
+def test_released_with_image(images):
+    cache = imagecache.get_cache()
+    images[0].raw()
+    count = len(cache)
+    del images[0]
+    gc.collect()
+    assert len(cache) == count - 1
+
+def test_cache_disabled(images):
+    imagecache.set_cache_size(None)
+    try:
+        for img in images:
+            img.radiance()
+        assert len(imagecache.get_cache()) == 0
+        assert all(img._Image__radiance_image is not None for img in images)
+    finally:
+        imagecache.set_cache_size(imagecache.CACHE_BYTES)
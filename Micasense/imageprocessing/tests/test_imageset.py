@@ -61,4 +61,34 @@ def test_as_nested_lists():
     assert imgset is not None
     data, columns = imgset.as_nested_lists()
     assert data[0][1] == 36.576096
-    assert columns[0] == 'timestamp'
\ No newline at end of file
+    assert columns[0] == 'timestamp'
+
+def test_table():
+    imgset = imageset.ImageSet.from_directory(files_dir())
+    assert len(imgset.table) == 10
+    assert list(imgset.table['capture_index']) == [0]*5 + [1]*5
+    for i, cap in enumerate(imgset.captures):
+        rows = imgset.table[imgset.table['capture_index'] == i]
+        assert list(rows['dls_irradiance']) == pytest.approx(cap.dls_irradiance())
+
+def test_as_dataframe(files_dir):
+    pytest.importorskip('pandas')
+    imgset = imageset.ImageSet.from_directory(files_dir)
+    df = imgset.as_dataframe()
+    assert len(df) == 10
+    assert list(df.columns) == list(imgset.table.dtype.names)
+    assert list(df['band_name'][:5]) == ['Blue', 'Green', 'Red', 'NIR', 'Red edge']
+    assert list(df['altitude']) == list(imgset.table['altitude'])
+    assert str(df['timestamp'].dtype).startswith('datetime64')
+
+def test_dls_irradiance():
+    imgset = imageset.ImageSet.from_directory(files_dir())
+    series = imgset.dls_irradiance()
+    assert len(series) == 2
+    assert series['2017-10-19T20:40:39.200174+00:00'] == pytest.approx(imgset.captures[0].dls_irradiance())
+
+def test_where():
+    imgset = imageset.ImageSet.from_directory(files_dir())
+    high = imgset.where(imgset.table['altitude'] > 150)
+    assert len(high.captures) == 1
+    assert high.captures[0] is imgset.captures[1]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test image utilities
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import os
+import cv2
+import numpy as np
+
+import micasense.image as image
+import micasense.imageutils as imageutils
+import micasense.radiometry as radiometry
+
+@pytest.fixture()
+def img():
+    return image.Image(os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif'))
+
+def lens(img):
+    return img.cv2_camera_matrix(), img.cv2_distortion_coeff(), img.size()
+
+def test_undistortion_maps_shared(img):
+    maps = imageutils.undistortion_maps(*lens(img), camera=(img.camera_serial, img.band_index))
+    assert imageutils.undistortion_maps(*lens(img), camera=(img.camera_serial, img.band_index)) is maps
+    assert maps[0].shape == (960, 1280)
+    fixed = imageutils.undistortion_maps(*lens(img), map_type=cv2.CV_16SC2)
+    assert fixed[0].dtype == np.int16
+    assert fixed[0].shape == (960, 1280, 2)
+
+def test_undistortion_maps_persisted(img, tmpdir):
+    imageutils.set_undistortion_map_dir(str(tmpdir))
+    try:
+        radiometry.clear_cache()
+        map1, map2 = imageutils.undistortion_maps(*lens(img))
+        assert len(os.listdir(str(tmpdir))) == 1
+        radiometry.clear_cache()
+        loaded1, loaded2 = imageutils.undistortion_maps(*lens(img))
+        assert np.array_equal(map1, loaded1)
+        assert np.array_equal(map2, loaded2)
+    finally:
+        imageutils.set_undistortion_map_dir(None)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test processing manifest
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import pytest
+import os
+import shutil
+
+import micasense.manifest as manifest
+
+calibration = {'Blue': 0.5, 'Green': 0.6}
+config = {'version': '0.0.1', 'dtype': 'float32'}
+
+@pytest.fixture()
+def files(tmpdir):
+    source = os.path.join(str(tmpdir), 'IMG_0000_1.tif')
+    output = os.path.join(str(tmpdir), 'out', 'IMG_0000_1.tif')
+    shutil.copy(os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif'), source)
+    os.makedirs(os.path.dirname(output))
+    shutil.copy(source, output)
+    return source, output
+
+@pytest.fixture()
+def record(tmpdir, files):
+    record = manifest.Manifest(os.path.join(str(tmpdir), 'manifest.sqlite'))
+    record.record([files + ('Blue',)], calibration, config)
+    yield record
+    record.close()
+
+def test_current(record, files):
+    assert len(record) == 1
+    assert record.current([files], calibration, config) == [files]
+    assert record.verify(files[1])
+
+def test_changed_calibration(record, files):
+    assert record.current([files], {'Blue': 0.55, 'Green': 0.6}, config) == []
+    assert record.current([files], {'Blue': 0.5, 'Green': 0.7}, config) == [files]
+
+def test_changed_config(record, files):
+    assert record.current([files], calibration, dict(config, dtype='uint16')) == []
+
+def test_changed_source(record, files):
+    os.utime(files[0], ns=(0, 0))
+    assert record.current([files], calibration, config) == []
+
+def test_changed_output(record, files):
+    with open(files[1], 'ab') as f:
+        f.write(b'\0')
+    assert record.current([files], calibration, config) == []
+    assert not record.verify(files[1])
+    os.remove(files[1])
+    assert record.current([files], calibration, config) == []
+
+def test_clear(record, files):
+    record.clear()
+    assert len(record) == 0
+    assert record.current([files], calibration, config) == []
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test metadata cache
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import os, shutil
+
+import micasense.metacache as metacache
+import micasense.metadata as metadata
+
+@pytest.fixture()
+def image_name(tmpdir):
+    src = os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif')
+    dst = os.path.join(str(tmpdir), 'IMG_0000_1.tif')
+    shutil.copy(src, dst)
+    return dst
+
+@pytest.fixture()
+def cache(tmpdir):
+    cache = metacache.MetadataCache(os.path.join(str(tmpdir), 'metadata.sqlite'))
+    yield cache
+    cache.close()
+
+def test_put_get(cache, image_name):
+    assert cache.get(image_name) is None
+    cache.put(image_name, {'XMP:BandName': 'Blue'})
+    assert cache.get(image_name) == {'XMP:BandName': 'Blue'}
+    assert len(cache) == 1
+
+def test_invalidated_by_mtime(cache, image_name):
+    cache.put(image_name, {'XMP:BandName': 'Blue'})
+    stat = os.stat(image_name)
+    os.utime(image_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert cache.get(image_name) is None
+
+def test_metadata_uses_cache(tmpdir, image_name):
+    metadata.set_cache(os.path.join(str(tmpdir), 'metadata.sqlite'))
+    try:
+        meta = metadata.Metadata(image_name, backend='native')
+        assert metadata.get_cache().get(image_name) == meta.get_all()
+        # a fake cached entry shows that the cache, not the file, is read
+        metadata.get_cache().put(image_name, dict(meta.get_all(), **{'XMP:BandName': 'Cached'}))
+        assert metadata.Metadata(image_name, backend='native').band_name() == 'Cached'
+        assert metadata.Metadata.from_files([image_name], backend='native')[0].band_name() == 'Cached'
+    finally:
+        metadata.set_cache(None)
+
+def test_scan_not_cached(tmpdir, image_name):
+    metadata.set_cache(os.path.join(str(tmpdir), 'metadata.sqlite'))
+    try:
+        meta = metadata.Metadata(image_name, backend='native', scan=True)
+        assert meta.band_name() is not None
+        assert metadata.get_cache().get(image_name) is None
+        full = metadata.Metadata(image_name, backend='native')
+        assert metadata.get_cache().get(image_name) == full.get_all()
+        # a scan is served from the full cached entry
+        assert metadata.Metadata(image_name, backend='native', scan=True).exif == metadata.scan_subset(full.get_all())
+    finally:
+        metadata.set_cache(None)
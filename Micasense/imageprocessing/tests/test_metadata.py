@@ -25,6 +25,7 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import pytest
 import os, glob
+import multiprocessing
 
 import micasense.metadata as metadata
 
@@ -126,4 +127,54 @@ def test_dls_irradiance(meta):
     assert meta.dls_irradiance() == pytest.approx(1.0848, abs=0.0001)
 
 def test_dls_pose(meta):
-    assert meta.dls_pose() == pytest.approx((-3.070, -0.188, -0.013), abs=0.001)
\ No newline at end of file
+    assert meta.dls_pose() == pytest.approx((-3.070, -0.188, -0.013), abs=0.001)
+
+def test_exiftool_session_shared():
+    with metadata.exiftool_session() as session:
+        with metadata.exiftool_session() as inner:
+            assert inner is session
+        assert session.running()
+    assert not session.running()
+
+def test_metadata_reuses_session():
+    image_path = os.path.join('data', '0000SET', '000')
+    with metadata.exiftool_session() as session:
+        meta1 = metadata.Metadata(os.path.join(image_path, 'IMG_0000_1.tif'))
+        meta2 = metadata.Metadata(os.path.join(image_path, 'IMG_0000_2.tif'))
+        assert session.refcount == 1
+    assert meta1.band_index() == 0
+    assert meta2.band_index() == 1
+
+def test_hold_missing_exiftool():
+    # a Pool initializer which raises would make the Pool respawn its workers forever
+    metadata.set_backend('exiftool')
+    try:
+        missing = os.path.join('data', 'no-exiftool')
+        assert metadata.hold_exiftool_session(missing) is None
+        pool = multiprocessing.Pool(2, initializer=metadata.hold_exiftool_session, initargs=(missing,))
+        try:
+            assert pool.map(abs, [1, -2]) == [1, 2]
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        metadata.set_backend(None)
+
+def test_from_files():
+    image_path = os.path.join('data', '0000SET', '000')
+    files = [os.path.join(image_path, 'IMG_0000_{}.tif'.format(band)) for band in range(1, 6)]
+    metas = metadata.Metadata.from_files(files, batch_size=2)
+    assert len(metas) == len(files)
+    assert [meta.band_index() for meta in metas] == [0, 1, 2, 3, 4]
+    assert metas[0].capture_id() == '5v25BtsZg3BQBhVH7Iaz'
+
+def test_scan():
+    image_path = os.path.join('data', '0000SET', '000')
+    meta = metadata.Metadata(os.path.join(image_path, 'IMG_0000_1.tif'), scan=True)
+    assert set(meta.exif) <= set(metadata.SCAN_TAGS) | {'SourceFile'}
+    assert meta.band_index() == 0
+    assert meta.dls_pose() == pytest.approx((-3.070, -0.188, -0.013), abs=0.001)
+    assert meta.scan
+    # tags outside of the scan are fetched on demand
+    assert meta.get_item('EXIF:Orientation') is not None
+    assert not meta.scan
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test metadata transfer
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import os
+import cv2
+import numpy as np
+
+import micasense.metadata as metadata
+import micasense.metadatawriter as metadatawriter
+
+@pytest.fixture()
+def image_name():
+    return os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif')
+
+def write_output(tmpdir, name):
+    output = os.path.join(str(tmpdir), name)
+    cv2.imwrite(output, np.zeros((4, 4), dtype=np.float32))
+    return output
+
+def test_transfer_commands():
+    pairs = [(os.path.join('raw', 'IMG_0000_1.tif'), os.path.join('out', 'IMG_0000_1.tif')),
+             (os.path.join('raw', 'IMG_0000_2.tif'), os.path.join('out', 'IMG_0000_2.tif')),
+             (os.path.join('raw', 'IMG_0000_3.tif'), os.path.join('out', 'renamed.tif'))]
+    commands = metadatawriter.transfer_commands(pairs)
+    assert len(commands) == 2
+    single = [args for args, outputs in commands if outputs == [os.path.join('out', 'renamed.tif')]][0]
+    assert single[:2] == ['-tagsFromFile', os.path.join('raw', 'IMG_0000_3.tif')]
+    batch = [args for args, outputs in commands if len(outputs) == 2][0]
+    assert batch[1] == os.path.join(os.path.abspath('raw'), '%f.tif')
+    assert batch[-2:] == [os.path.join('out', 'IMG_0000_1.tif'), os.path.join('out', 'IMG_0000_2.tif')]
+
+def test_metadata_writer(tmpdir, image_name):
+    output = write_output(tmpdir, os.path.basename(image_name))
+    with metadatawriter.MetadataWriter() as writer:
+        writer.submit(image_name, output)
+    meta = metadata.Metadata(output)
+    assert meta.band_name() == 'Blue'
+    assert meta.capture_id() == '5v25BtsZg3BQBhVH7Iaz'
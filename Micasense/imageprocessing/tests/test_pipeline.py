@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test reader, compute and writer pipeline
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import pytest
+import threading
+
+import micasense.pipeline as pipeline
+
+def square(x):
+    return x * x
+
+def fail_on_seven(x):
+    if x == 7:
+        raise ValueError("seven")
+    return x
+
+def test_run():
+    stages = pipeline.Pipeline(lambda item: item + 1, square, lambda item, result: (item, result), workers=2)
+    assert sorted(stages.run(range(20))) == [(i, (i + 1) ** 2) for i in range(20)]
+    assert stages.run([]) == []
+
+def test_processes():
+    stages = pipeline.Pipeline(lambda item: item + 1, square, lambda item, result: (item, result), workers=2,
+                               processes=True)
+    assert sorted(stages.run(range(20))) == [(i, (i + 1) ** 2) for i in range(20)]
+    with pytest.raises(ValueError):
+        pipeline.Pipeline(lambda item: item, fail_on_seven, lambda item, result: result, workers=2,
+                          processes=True).run(range(20))
+
+def test_progress():
+    fractions = []
+    pipeline.Pipeline(lambda item: item, square, lambda item, result: result,
+                      workers=1).run(range(4), fractions.append)
+    assert fractions == [0.25, 0.5, 0.75, 1.0]
+
+@pytest.mark.parametrize('stage', ['read', 'compute', 'write'])
+def test_error(stage):
+    def read(item):
+        if stage == 'read' and item == 7:
+            raise IOError("seven")
+        return item
+    def write(item, result):
+        if stage == 'write' and item == 7:
+            raise IOError("seven")
+        return result
+    compute = fail_on_seven if stage == 'compute' else square
+    with pytest.raises(ValueError if stage == 'compute' else IOError):
+        pipeline.Pipeline(read, compute, write, workers=2).run(range(50))
+
+def test_bounded():
+    # items read but not yet written are limited by the queues between the stages
+    lock = threading.Lock()
+    outstanding = [0, 0]
+    def read(item):
+        with lock:
+            outstanding[0] += 1
+            outstanding[1] = max(outstanding)
+        return item
+    def write(item, result):
+        with lock:
+            outstanding[0] -= 1
+        threading.Event().wait(0.005)
+        return result
+    stages = pipeline.Pipeline(read, square, write, readers=2, workers=1, writers=1, queue_size=3)
+    assert len(stages.run(range(40))) == 40
+    # in the two queues, or held by one of the threads of the stages
+    assert outstanding[1] <= 2 * 3 + 2 + 1 + 1
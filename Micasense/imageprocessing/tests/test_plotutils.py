@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test plotting utilities
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import pytest
+import os
+import cv2
+import numpy as np
+import matplotlib.pyplot as plt
+
+import micasense.plotutils as plotutils
+
+@pytest.fixture()
+def images():
+    return [np.random.RandomState(i).rand(960, 1280).astype(np.float32) for i in range(3)]
+
+def test_downsample(images):
+    small = plotutils.downsample(images[0])
+    assert small.shape == (320, 427)
+    assert small[1, 1] == images[0][3, 3]
+
+def test_headless(images):
+    plt.close('all')
+    plotutils.set_mode('headless')
+    try:
+        assert plotutils.plotwithcolorbar(images[0], 'Radiance') == (None, None)
+        assert plotutils.subplotwithcolorbar(2, 2, images, ['a', 'b', 'c']) == (None, None)
+        assert plt.get_fignums() == []
+    finally:
+        plotutils.set_mode(None)
+
+def test_png(tmpdir, images):
+    plotutils.set_mode('png', str(tmpdir))
+    try:
+        plotutils.plotwithcolorbar(images[0], 'Vignette Factor')
+        plotutils.subplot(2, 2, images, ['a', 'b', 'c'])
+        plotutils.plot_overlay_withcolorbar(images[0], images[1], 'Overlay')
+        plotutils.flush_diagnostics()
+    finally:
+        plotutils.set_mode(None)
+    assert sorted(os.listdir(str(tmpdir))) == ['00001_Vignette_Factor.png', '00002_a.png', '00003_Overlay.png']
+    assert cv2.imread(os.path.join(str(tmpdir), '00001_Vignette_Factor.png')) is not None
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test radiometric correction maps
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import numpy as np
+
+import micasense.radiometry as radiometry
+
+def test_vignette_map_shared():
+    v1 = radiometry.vignette_map((640.5, 480.5), [1e-4, -1e-8], 1280, 960)
+    v2 = radiometry.vignette_map([640.5, 480.5], (1e-4, -1e-8), 1280, 960)
+    assert v1 is v2
+    assert v1.shape == (960, 1280)
+    assert v1.dtype == np.float32
+    assert not v1.flags.writeable
+
+def test_vignette_map_values():
+    vignette = radiometry.vignette_map((2.0, 1.0), [0.5], 5, 3)
+    x, y = np.meshgrid(np.arange(5), np.arange(3))
+    expected = 1. / (1. + 0.5 * np.hypot(x - 2.0, y - 1.0))
+    assert vignette == pytest.approx(expected)
+
+def test_row_gradient():
+    gradient = radiometry.row_gradient([1.0, 2e-5, 1e-6], 0.001, 4)
+    assert gradient.shape == (4, 1)
+    y = np.arange(4)[:, np.newaxis]
+    assert gradient == pytest.approx(1.0 / (1.0 + 2e-5 * y / 0.001 - 1e-6 * y))
+    assert radiometry.row_gradient([1.0, 2e-5, 1e-6], 0.002, 4) is not gradient
+    assert gradient.dtype == np.float32
+    precise = radiometry.row_gradient([1.0, 2e-5, 1e-6], 0.001, 4, dtype='float64')
+    assert precise.dtype == np.float64
+    assert np.array_equal(precise, 1.0 / (1.0 + 2e-5 * y / 0.001 - 1e-6 * y))
+
+def test_cache_bounded():
+    cache = radiometry.CorrectionCache(max_bytes=1000)
+    a = cache.get('a', lambda: np.zeros(100, dtype=np.float32))
+    cache.get('b', lambda: np.zeros(100, dtype=np.float32))
+    assert len(cache) == 2
+    cache.get('c', lambda: np.zeros(100, dtype=np.float32))
+    assert len(cache) == 2
+    assert cache.nbytes == 800
+    assert cache.get('a', lambda: np.ones(100, dtype=np.float32)) is not a
+
+def test_calibrate():
+    raw = np.array([[100, 200, 300], [50, 400, 500]], dtype=np.uint16)
+    vignette = np.array([[1.0, 1.5, 2.0], [1.0, 1.0, 1.0]], dtype=np.float32)
+    row_gradient = np.array([[1.0], [0.5]], dtype=np.float32)
+    out = radiometry.calibrate(raw, 100.0, vignette, row_gradient, scale=2.0)
+    assert out.dtype == np.float32
+    expected = np.maximum(vignette * row_gradient * (raw.astype(float) - 100.0), 0) * 2.0
+    assert out == pytest.approx(expected)
+    assert radiometry.calibrate(raw, 100.0, vignette, row_gradient, out=out) is out
+
+def test_scale_factors():
+    radiance_scale, intensity_scale = radiometry.scale_factors([2.0, 0, 0], 2.0, 0.5, 4)
+    assert intensity_scale == pytest.approx(1.0 / 16)
+    assert radiance_scale == pytest.approx(2.0 / 16)
+
+def test_dtype_policy():
+    assert radiometry.get_dtype() == 'float32'
+    radiometry.set_dtype(np.float16)
+    try:
+        assert radiometry.get_dtype() == 'float16'
+        assert radiometry.get_dtype('float64') == 'float64'
+        assert radiometry.compute_dtype() == np.float32
+    finally:
+        radiometry.set_dtype(None)
+    with pytest.raises(ValueError):
+        radiometry.get_dtype('int8')
+
+def test_convert_uint16():
+    reflectance = np.array([[-0.1, 0.0, 0.5], [1.0, 1.5, 3.0]], dtype=np.float32)
+    scaled = radiometry.convert(reflectance, 'uint16', reflectance=True)
+    assert scaled.dtype == np.uint16
+    assert list(scaled.ravel()) == [0, 0, 16384, 32768, 49152, 65535]
+    assert radiometry.reflectance_values(scaled)[0, 2] == pytest.approx(0.5)
+    assert radiometry.convert(reflectance, 'uint16').dtype == np.float32
+
+def test_calibrate_streaming():
+    raw = np.random.RandomState(0).randint(0, 65535, size=(37, 29)).astype(np.uint16)
+    center, polynomial = (14.0, 18.0), (1e-4, 1e-6)
+    row_gradient = radiometry.row_gradient([1.0, 1e-3, 1e-2], 0.001, 37)
+    radiometry.clear_cache()
+    streamed = radiometry.calibrate_streaming(raw, 1000.0, center, polynomial, row_gradient, 2.0, block_rows=8)
+    assert len(radiometry.get_cache()) == 0
+    vignette = radiometry.vignette_map(center, polynomial, 29, 37)
+    expected = radiometry.calibrate(raw, 1000.0, vignette, row_gradient, 2.0)
+    assert np.allclose(streamed, expected, rtol=1e-6)
+    out = np.empty((37, 29), dtype=np.uint16)
+    scaled = radiometry.calibrate_streaming(raw, 1000.0, center, polynomial, row_gradient, 1e-6,
+                                            out=out, block_rows=5, reflectance=True)
+    assert scaled is out
+    expected = radiometry.convert(radiometry.calibrate(raw, 1000.0, vignette, row_gradient, 1e-6),
+                                  'uint16', reflectance=True)
+    assert np.abs(scaled.astype(int) - expected).max() <= 1
+    # radiance is not scaled to uint16, so it is not truncated into an integer output
+    with pytest.raises(ValueError):
+        radiometry.calibrate_streaming(raw, 1000.0, center, polynomial, row_gradient, 1e-6, out=out)
+    with pytest.raises(ValueError):
+        radiometry.calibrate_streaming(raw, 1000.0, center, polynomial, row_gradient, 1e-6,
+                                       out=np.empty((37, 29), dtype=np.int32), reflectance=True)
+
+def test_vignette_map_dtype():
+    vignette = radiometry.vignette_map((2.0, 1.0), [0.5], 5, 3)
+    precise = radiometry.vignette_map((2.0, 1.0), [0.5], 5, 3, dtype='float64')
+    assert vignette.dtype == np.float32
+    assert precise.dtype == np.float64
+    x, y = np.meshgrid(np.arange(5), np.arange(3))
+    assert np.array_equal(precise, 1. / (1. + 0.5 * np.hypot(x - 2.0, y - 1.0)))
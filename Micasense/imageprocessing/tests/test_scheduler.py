@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test multi-flight scheduler
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import pytest
+import os
+import json
+
+import micasense.batch as batch
+import micasense.scheduler as scheduler
+
+calibration = {'Blue': 0.5, 'Green': 0.6, 'Red': 0.7, 'NIR': 0.8, 'Red edge': 0.9}
+
+panel_image_name = os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif')
+panel_corners = [[809, 613], [648, 615], [646, 454], [808, 452]]
+
+@pytest.fixture()
+def flights(tmpdir):
+    return [scheduler.Flight('large', os.path.join('data', '0000SET'), os.path.join(str(tmpdir), 'large'),
+                             calibration='unused.json'),
+            scheduler.Flight('small', os.path.join('data', '0001SET'), os.path.join(str(tmpdir), 'small'),
+                             calibration='unused.json')]
+
+def test_interleave():
+    assert scheduler.interleave([[1, 2, 3], [], ['a'], ['b', 'c']]) == [1, 'a', 'b', 2, 'c', 3]
+
+def test_load_flights(tmpdir):
+    path = os.path.join(str(tmpdir), 'flights.json')
+    with open(path, 'w') as f:
+        json.dump([{'input': 'flight1/raw/', 'output': 'out1', 'panels': ['pre', 'post']},
+                   {'name': 'two', 'input': 'raw', 'output': 'out2', 'calibration': 'calibration.json'}], f)
+    flights = scheduler.load_flights(path, {'Blue': 0.67})
+    assert [flight.name for flight in flights] == ['raw', 'two']
+    assert flights[0].panels == ['pre', 'post']
+    assert flights[0].panel_reflectance == {'Blue': 0.67}
+    with pytest.raises(ValueError):
+        scheduler.load_flights(path)
+
+def test_duplicate_names(flights):
+    with pytest.raises(ValueError):
+        scheduler.process_flights([flights[0], flights[0]], {'large': calibration})
+
+def test_calibrate_flights(tmpdir):
+    calibration_file = os.path.join(str(tmpdir), 'calibration.json')
+    batch.save_calibration(calibration, calibration_file)
+    flights = [scheduler.Flight(name, 'raw', os.path.join(str(tmpdir), name), [panel_image_name, panel_image_name],
+                                {'Blue': reflectance}, {panel_image_name: panel_corners})
+               for name, reflectance in [('one', 0.67), ('two', 0.5)]]
+    flights.append(scheduler.Flight('three', 'raw', os.path.join(str(tmpdir), 'three'), calibration=calibration_file))
+    calibrations = scheduler.calibrate_flights(flights, workers=2)
+    assert calibrations['one']['Blue'] == pytest.approx(0.67 / 0.170284, rel=0.01)
+    assert calibrations['two']['Blue'] == pytest.approx(0.5 / 0.170284, rel=0.01)
+    assert calibrations['three'] == calibration
+    assert batch.load_calibration(os.path.join(str(tmpdir), 'one', scheduler.CALIBRATION_NAME)) == calibrations['one']
+
+def test_process_flights(flights):
+    progress = {}
+    done = scheduler.process_flights(flights, {'large': calibration, 'small': calibration}, workers=2,
+                                     transfer_metadata=False,
+                                     progress_callback=lambda name, fraction: progress.setdefault(name, []).append(fraction))
+    assert len(done['large'][0]) == 10
+    assert done['large'][1] == []
+    assert done['small'][0] == [(os.path.join('data', '0001SET', '000', 'IMG_0002_4.tif'),
+                              os.path.join(flights[1].output_dir, '000', 'IMG_0002_4.tif'))]
+    assert progress['large'][-1] == 1.0 and len(progress['large']) == 10
+    assert progress['small'] == [1.0]
+    for flight in flights:
+        assert os.path.isfile(os.path.join(flight.output_dir, batch.MANIFEST_NAME))
+    # every flight is up to date
+    done = scheduler.process_flights(flights, {'large': calibration, 'small': calibration}, workers=2,
+                                     transfer_metadata=False)
+    assert done == {'large': ([], []), 'small': ([], [])}
+
+@pytest.mark.parametrize('processes', [True, False])
+def test_missing_band(flights, processes):
+    done = scheduler.process_flights(flights, {'large': {'Blue': 0.5}, 'small': calibration}, workers=2,
+                                     transfer_metadata=False, processes=processes)
+    assert len(done['large'][0]) == 2
+    assert len(done['large'][1]) == 8
+    assert len(done['small'][0]) == 1
+
+def test_close_error(flights, monkeypatch):
+    def close(self):
+        raise RuntimeError('close failed')
+    monkeypatch.setattr(batch.Conversion, 'close', close)
+    with pytest.raises(RuntimeError):
+        scheduler.process_flights(flights[1:], {'small': calibration}, transfer_metadata=False)
+    # the error of the pipeline is not replaced by the one from close()
+    def progress(name, fraction):
+        raise ValueError('progress failed')
+    with pytest.raises(ValueError):
+        scheduler.process_flights(flights[1:], {'small': calibration}, transfer_metadata=False,
+                                  progress_callback=progress)
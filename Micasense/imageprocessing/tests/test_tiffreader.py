@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test in-process TIFF tag reader
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import pytest
+import os
+import cv2
+import numpy as np
+
+import micasense.tiffreader as tiffreader
+import micasense.metadata as metadata
+
+@pytest.fixture()
+def image_name():
+    return os.path.join('data', '0000SET', '000', 'IMG_0000_1.tif')
+
+@pytest.fixture()
+def exif(image_name):
+    return tiffreader.read_metadata(image_name)
+
+@pytest.fixture()
+def meta(image_name):
+    return metadata.Metadata(image_name, backend='native')
+
+def test_exif_tags(exif):
+    assert exif['EXIF:Make'] == 'MicaSense'
+    assert exif['EXIF:Model'] == 'RedEdge'
+    assert exif['EXIF:ImageWidth'] == 1280
+    assert exif['EXIF:ImageHeight'] == 960
+    assert exif['EXIF:BitsPerSample'] == 16
+    assert exif['EXIF:BlackLevel'] == '4800 4800 4800 4800'
+    assert exif['EXIF:ExposureTime'] == pytest.approx(0.0004725)
+    assert exif['EXIF:ISOSpeed'] == 100
+
+def test_gps_tags(exif):
+    assert exif['EXIF:GPSLatitude'] == 36.576096
+    assert exif['EXIF:GPSLatitudeRef'] == 'N'
+    assert exif['EXIF:GPSLongitude'] == 119.4352689
+    assert exif['EXIF:GPSLongitudeRef'] == 'W'
+    assert exif['EXIF:GPSAltitude'] == 101.861
+
+def test_xmp_tags(exif):
+    assert exif['XMP:BandName'] == 'Blue'
+    assert exif['XMP:CaptureId'] == '5v25BtsZg3BQBhVH7Iaz'
+    assert exif['XMP:RigCameraIndex'] == 0
+    assert len(exif['XMP:RadiometricCalibration']) == 3
+    assert len(exif['XMP:VignettingPolynomial']) == 6
+    assert exif['XMP:PrincipalPoint'] == '2.35363,1.79947'
+
+def test_json_value():
+    assert tiffreader.json_value('475') == 475
+    assert tiffreader.json_value('-3.5e-05') == pytest.approx(-3.5e-05)
+    assert tiffreader.json_value('0230') == '0230'
+    assert tiffreader.json_value('v3.3.0') == 'v3.3.0'
+
+def test_not_a_tiff():
+    with pytest.raises(IOError):
+        tiffreader.read_metadata(os.path.join('tests', '__init__.py'))
+
+def test_native_metadata(meta):
+    assert meta.band_name() == 'Blue'
+    assert meta.black_level() == 4800.0
+    assert meta.position() == pytest.approx((36.576096, -119.4352689, 101.861))
+    assert meta.utc_time().strftime('%Y-%m-%d %H:%M:%S.%f') == '2017-10-19 20:40:39.200174'
+    assert meta.radiometric_cal() == pytest.approx([0.00014648541280593884, 1.1794106515704275e-07, 1.3974330853826152e-06])
+    assert meta.dls_pose() == pytest.approx((-3.070, -0.188, -0.013), abs=0.001)
+
+def test_native_metadata_v3():
+    image_name = os.path.join('data', '0001SET', '000', 'IMG_0002_4.tif')
+    meta = metadata.Metadata(image_name, backend='native')
+    assert meta.focal_length_mm() == pytest.approx(5.45221099)
+    assert meta.utc_time().strftime('%Y-%m-%d %H:%M:%S.%f') == '2018-04-10 10:52:30.866550'
+
+def test_native_from_files():
+    image_path = os.path.join('data', '0000SET', '000')
+    files = [os.path.join(image_path, 'IMG_0000_{}.tif'.format(band)) for band in range(1, 6)]
+    metas = metadata.Metadata.from_files(files, backend='native')
+    assert [meta.band_index() for meta in metas] == [0, 1, 2, 3, 4]
+
+def test_memmap_raw(image_name):
+    raw = tiffreader.memmap_raw(image_name)
+    assert isinstance(raw, np.memmap)
+    assert raw.shape == (960, 1280)
+    assert np.array_equal(raw, cv2.imread(image_name, -1))
+    assert not raw.flags.writeable
+    assert tiffreader.memmap_raw(image_name, mode='c').flags.writeable
+
+def test_memmap_raw_compressed(tmpdir):
+    compressed = os.path.join(str(tmpdir), 'compressed.tif')
+    cv2.imwrite(compressed, np.arange(64, dtype=np.uint16).reshape(8, 8),
+                [cv2.IMWRITE_TIFF_COMPRESSION, 5]) # LZW
+    assert tiffreader.memmap_raw(compressed) is None
+
+def test_read_image(image_name, exif):
+    tags, raw = tiffreader.read_image(image_name)
+    assert tags == exif
+    assert raw.dtype == np.uint16
+    assert raw.flags.writeable
+    assert np.array_equal(raw, cv2.imread(image_name, -1))
+
+def test_read_image_compressed(tmpdir):
+    compressed = os.path.join(str(tmpdir), 'compressed.tif')
+    pixels = np.arange(64, dtype=np.uint16).reshape(8, 8)
+    cv2.imwrite(compressed, pixels, [cv2.IMWRITE_TIFF_COMPRESSION, 5]) # LZW
+    _, raw = tiffreader.read_image(compressed)
+    assert np.array_equal(raw, pixels)
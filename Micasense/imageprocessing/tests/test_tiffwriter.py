@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Test TIFF writer
+
+Copyright 2017 MicaSense, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+import pytest
+import os
+import cv2
+import numpy as np
+
+import micasense.tiffreader as tiffreader
+import micasense.tiffwriter as tiffwriter
+
+@pytest.fixture()
+def reflectance():
+    return np.random.RandomState(0).uniform(0, 0.8, size=(100, 150)).astype(np.float32)
+
+def write_uint16(tmpdir, reflectance, **options):
+    filename = os.path.join(str(tmpdir), 'reflectance_uint16.tif')
+    tiffwriter.write_reflectance(filename, reflectance, dtype='uint16', **options)
+    return filename
+
+def test_uncompressed(tmpdir, reflectance):
+    filename = os.path.join(str(tmpdir), 'reflectance.tif')
+    tiffwriter.write_tiff(filename, reflectance, compression='none')
+    assert np.array_equal(cv2.imread(filename, cv2.IMREAD_UNCHANGED), reflectance)
+    # uncompressed uint16 strips are contiguous, so they can be memory mapped
+    filename = write_uint16(tmpdir, reflectance, compression='none')
+    assert np.array_equal(tiffreader.memmap_raw(filename), cv2.imread(filename, cv2.IMREAD_UNCHANGED))
+
+@pytest.mark.parametrize('tile', [None, 32])
+@pytest.mark.parametrize('predictor', [False, True])
+def test_deflate(tmpdir, reflectance, tile, predictor):
+    filename = os.path.join(str(tmpdir), 'reflectance.tif')
+    tiffwriter.write_tiff(filename, reflectance, compression='deflate', predictor=predictor, tile=tile, threads=2)
+    assert np.array_equal(cv2.imread(filename, cv2.IMREAD_UNCHANGED), reflectance)
+    uint16 = cv2.imread(write_uint16(tmpdir, reflectance, predictor=predictor, tile=tile), cv2.IMREAD_UNCHANGED)
+    assert uint16.dtype == np.uint16
+    assert np.abs(uint16 / 32768.0 - reflectance).max() <= 0.5 / 32768
+
+def test_available():
+    assert tiffwriter.available('deflate', tile=32)
+    assert tiffwriter.available('none')
+    for compression in ['lzw', 'zstd']:
+        assert tiffwriter.available(compression, tile=32) == (tiffwriter.encoder(compression) is not None)
+
+def test_invalid(tmpdir, reflectance):
+    filename = os.path.join(str(tmpdir), 'reflectance.tif')
+    with pytest.raises(ValueError):
+        tiffwriter.write_tiff(filename, reflectance.astype(np.int32))
+    with pytest.raises(ValueError):
+        tiffwriter.write_tiff(filename, reflectance, tile=20)
+    with pytest.raises(ValueError):
+        tiffwriter.write_tiff(filename, reflectance, compression='jpeg')